@@ -0,0 +1,222 @@
+import asyncio
+import json
+import math
+import os
+import re
+import statistics
+
+import keyframes
+import progress
+import timeline
+
+# ==============================================================================
+# ---                 АНАЛИЗ ИСХОДНИКА И ПОДСКАЗКИ ТОЧЕК РЕЗА                  ---
+# ==============================================================================
+# Один потоковый проход ffmpeg по исходнику собирает сразу три ряда:
+#   тишину (silencedetect), громкость по секундам (ebur128, momentary) и смены
+#   сцены между I-кадрами (scene; декодируются только ключевые кадры).
+# Результат хранится рядом с индексом I-кадров в <видео>.analysis.json и
+# пересчитывается, если исходник изменился.
+# Перерыв — долгая тишина или долгий участок заметно тише речи. Границы перерыва
+# подгоняются к I-кадрам так, чтобы перекодированные края сегментов были ровно
+# по длительности перехода, а копируемая без потерь середина — максимальной.
+ANALYSIS_VERSION = 1
+SILENCE_NOISE_DB = -35        # порог тишины silencedetect, дБ
+SILENCE_MIN_DURATION = 2.0    # короче — не тишина, с
+SCENE_MIN_SCORE = 0.1         # смены сцены слабее не сохраняются
+LOUDNESS_FLOOR = -70.0        # громкость ниже — цифровая тишина, не учитывается в медиане речи
+QUIET_DROP_LU = 12.0          # "тихо" — на столько LU ниже медианной громкости речи
+BREAK_MIN_DURATION = 60.0     # перерыв — тишина или тихий участок не короче этого, с
+EDGE_TOLERANCE = 1.0          # тишина в пределах секунды от начала/конца — это край записи
+SNAP_MARGIN = 0.002           # запас, чтобы точка разделения попала строго на нужный I-кадр
+SCENE_WINDOW = 2.0            # смены сцены в пределах этого расстояния от перерыва учитываются
+ANALYSIS_WORKERS = 1
+
+_SILENCE_START = re.compile(r"silence_start:\s*(-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end:\s*(-?[\d.]+)")
+_EBUR128 = re.compile(r"\bt:\s*([\d.]+)\s+TARGET:.*?\bM:\s*(-?[\d.]+|-?inf|nan)")
+_PTS_TIME = re.compile(r"pts_time:\s*(-?[\d.]+)")
+_SCENE = re.compile(r"lavfi\.scene_score=([\d.]+)")
+
+
+def analysis_path_for(source):
+    return f"{source}.analysis.json"
+
+
+def analysis_command(source):
+    graph = (f"[0:a:0]silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_DURATION},ebur128=framelog=info[a];"
+             f"[0:v:0]scale=160:-2,select='gt(scene,{SCENE_MIN_SCORE})',metadata=mode=print:key=lavfi.scene_score[v]")
+    return ['ffmpeg','-hide_banner','-nostats','-loglevel','info','-progress','pipe:1',
+            '-skip_frame:v','nokey','-i', source, '-filter_complex', graph,
+            '-map','[a]','-map','[v]','-f','null','-']
+
+
+class _Collector:
+    """Разбирает журнал ffmpeg построчно, не храня его целиком."""
+    def __init__(self):
+        self.silences = []
+        self.scenes = []
+        self._silence_start = None
+        self._pts_time = None
+        self._loudness = {}  # секунда -> (сумма, число)
+
+    def feed(self, line):
+        if m := _SILENCE_START.search(line):
+            self._silence_start = max(0.0, float(m.group(1)))
+        elif m := _SILENCE_END.search(line):
+            if self._silence_start is not None: self.silences.append([round(self._silence_start, 3), round(float(m.group(1)), 3)])
+            self._silence_start = None
+        elif m := _EBUR128.search(line):
+            try: value = float(m.group(2))
+            except ValueError: return
+            if math.isfinite(value):
+                total, count = self._loudness.get(int(float(m.group(1))), (0.0, 0))
+                self._loudness[int(float(m.group(1)))] = (total + value, count + 1)
+        elif m := _PTS_TIME.search(line):
+            self._pts_time = float(m.group(1))
+        elif (m := _SCENE.search(line)) and self._pts_time is not None:
+            self.scenes.append([round(self._pts_time, 3), round(float(m.group(1)), 3)])
+
+    def result(self, duration):
+        if self._silence_start is not None: self.silences.append([round(self._silence_start, 3), round(duration, 3)])
+        seconds = max(self._loudness) + 1 if self._loudness else 0
+        loudness = [round(self._loudness[s][0] / self._loudness[s][1], 1) if s in self._loudness else LOUDNESS_FLOOR for s in range(seconds)]
+        return {'silences': self.silences, 'scenes': self.scenes, 'loudness': loudness}
+
+
+def load(source):
+    """Сохранённый анализ или None, если его нет или исходник изменился."""
+    try:
+        with open(analysis_path_for(source), encoding='utf-8') as f:
+            data = json.load(f)
+        st = os.stat(source)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != ANALYSIS_VERSION or (data.get('size'), data.get('mtime_ns')) != (st.st_size, st.st_mtime_ns): return None
+    return data
+
+
+async def analyze(source, emit=None):
+    """Один проход по исходнику; `emit(event)` получает события прогресса (как в progress.ProgressTracker)."""
+    st = os.stat(source)
+    duration = await keyframes.probe_duration(source)
+    process = await asyncio.create_subprocess_exec(*analysis_command(source), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    collector = _Collector()
+    tracker = progress.ProgressTracker(duration, emit or (lambda event: asyncio.sleep(0)))
+
+    async def read_log():
+        async for raw in process.stderr: collector.feed(raw.decode(errors='ignore'))
+
+    async def read_progress():
+        async for raw in process.stdout: await tracker.feed(raw.decode(errors='ignore'))
+
+    try:
+        await asyncio.gather(read_log(), read_progress())
+        await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"Анализ {os.path.basename(source)}: ffmpeg завершился с кодом {process.returncode}")
+    data = {'version': ANALYSIS_VERSION, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'duration': duration, **collector.result(duration)}
+    path = analysis_path_for(source)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(f"{path}.tmp", path)
+    return data
+
+
+def quiet_intervals(data, min_duration=BREAK_MIN_DURATION):
+    """Долгие тихие участки: тишина по silencedetect и провалы громкости относительно речи."""
+    # Тишина в начале и в конце записи обрезается при любой длине.
+    intervals = [(s, e) for s, e in data['silences']
+                 if e - s >= min_duration or s <= EDGE_TOLERANCE or e >= data['duration'] - EDGE_TOLERANCE]
+    voiced = [m for m in data['loudness'] if m > LOUDNESS_FLOOR]
+    if voiced:
+        threshold = statistics.median(voiced) - QUIET_DROP_LU
+        run_start = None
+        for second, m in enumerate(data['loudness'] + [math.inf]):
+            if m < threshold and run_start is None: run_start = second
+            elif m >= threshold and run_start is not None:
+                if second - run_start >= min_duration: intervals.append((float(run_start), float(min(second, data['duration']))))
+                run_start = None
+    merged = []
+    for s, e in sorted(intervals):
+        if merged and s <= merged[-1][1]: merged[-1][1] = max(merged[-1][1], e)
+        else: merged.append([s, e])
+    return merged
+
+
+def suggest(data, index, fade_duration):
+    """Перерывы с границами, выровненными по I-кадрам.
+
+    'out' — конец сегмента перед перерывом: первый I-кадр после начала тишины + переход;
+    'in'  — начало сегмента после перерыва: последний I-кадр до конца тишины − переход.
+    Затухания приходятся на тишину, перекодируется ровно fade_duration, остальное копируется.
+    """
+    duration = data['duration']
+    breaks = []
+    for s, e in quiet_intervals(data):
+        head, tail = s <= EDGE_TOLERANCE, e >= duration - EDGE_TOLERANCE
+        out_kf = None if head else index.first_after(s)
+        in_kf = None if tail else index.last_before(e)
+        out_point = math.ceil((out_kf + fade_duration + SNAP_MARGIN) * 1000) / 1000 if out_kf is not None else None
+        in_point = math.floor((in_kf - fade_duration - SNAP_MARGIN) * 1000) / 1000 if in_kf is not None else None
+        if out_point is not None and out_point > duration: out_point = None
+        if in_point is not None and in_point < 0: in_point = None
+        if out_point is None and in_point is None: continue
+        # Перерыв короче GOP: границы перехлёстываются, разрезать по нему нельзя.
+        if out_point is not None and in_point is not None and in_point < out_point: continue
+        scene = max((score for t, score in data['scenes'] if s - SCENE_WINDOW <= t <= e + SCENE_WINDOW), default=0.0)
+        breaks.append({'quiet_from': s, 'quiet_to': e, 'out': out_point, 'in': in_point,
+                       'head': head, 'tail': tail, 'scene': scene})
+    return breaks
+
+
+def status_for(source, data, fade_duration, index):
+    """Статус для интерфейса: перерывы и минимальная длина сегмента."""
+    return {'path': source, 'state': 'ready', 'duration': data['duration'],
+            'breaks': suggest(data, index, fade_duration),
+            'min_segment': 2 * fade_duration + timeline.MIN_BODY_DURATION}
+
+
+class AnalysisManager:
+    """Фоновый анализ выбранных исходников; `notify(status)` рассылает результат клиентам.
+
+    `emit(tag, event)` — корутина для событий прогресса анализа.
+    """
+    def __init__(self, notify, emit, fade_duration, workers=ANALYSIS_WORKERS):
+        self._notify = notify
+        self._emit = emit
+        self._fade_duration = fade_duration
+        self._workers = workers
+        self._semaphore = None
+        self._tasks = {}
+
+    async def request(self, source):
+        """Статус сразу, если анализ и индекс I-кадров готовы; иначе работа уходит в фон."""
+        if not source or not os.path.isfile(source): return {'path': source, 'state': 'failed', 'error': "Файл не найден"}
+        data = load(source)
+        # Индекс здесь только открывается: его сборка — долгий ffprobe, обработчик сообщений ждать её не должен.
+        index = keyframes.cached_index(source) if data else None
+        if index:
+            with index: return status_for(source, data, self._fade_duration, index)
+        if source not in self._tasks: self._tasks[source] = asyncio.create_task(self._analyze(source, data))
+        return {'path': source, 'state': 'analyzing'}
+
+    async def _analyze(self, source, data=None):
+        if self._semaphore is None: self._semaphore = asyncio.Semaphore(self._workers)
+        tag = f"analysis {os.path.basename(source)}"
+        try:
+            if data is None:
+                async with self._semaphore:
+                    data = await analyze(source, lambda event: self._emit(tag, event))
+            with await keyframes.open_index(source) as index:
+                status = status_for(source, data, self._fade_duration, index)
+        except Exception as e:
+            status = {'path': source, 'state': 'failed', 'error': str(e)}
+        finally:
+            self._tasks.pop(source, None)
+        await self._notify(status)
@@ -0,0 +1,89 @@
+import asyncio
+
+import tempstore
+import transitions
+
+# ==============================================================================
+# ---                          СБОРКА ЗВУКОВОЙ ДОРОЖКИ                         ---
+# ==============================================================================
+# Каждый сегмент звучит из трёх кусков: fade-in [start, start_split],
+# основная часть [start_split, end_split] и fade-out [end_split, end].
+# Короткие края с затуханием рендерятся отдельно (в том же пуле и кэше, что и
+# видео-переходы), а основная часть подаётся в финальную сборку через входной
+# -ss: ffmpeg декодирует только нужный диапазон, а не весь файл с t=0.
+# Длины кусков задаются в сэмплах, поэтому стыки точны до сэмпла.
+EDGE_CODEC = "pcm_f32le"   # промежуточные края — без потерь и без лишнего квантования
+BODY_READ_MARGIN = 0.5     # запас чтения после нужного диапазона (с), лишнее отрезает atrim
+
+# Финальный кодек и его параметры; "pcm_s16le" — несжатый, как раньше.
+AUDIO_CODEC_OPTIONS = {
+    'pcm_s16le': [],
+    'flac': ['-compression_level', '5'],
+    'aac': ['-b:a', '256k'],
+    'libopus': ['-b:a', '160k'],
+}
+
+
+def codec_args(codec):
+    if codec not in AUDIO_CODEC_OPTIONS: raise ValueError(f"Неизвестный аудиокодек: {codec}")
+    return ['-c:a', codec] + AUDIO_CODEC_OPTIONS[codec]
+
+
+async def probe_sample_rate(source):
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=sample_rate', '-of', 'csv=p=0', source,
+        stdout=asyncio.subprocess.PIPE)
+    out, _ = await process.communicate()
+    try: return int(out.decode().strip().split('\n')[0])
+    except ValueError: raise ValueError(f"Не найдена звуковая дорожка в {source}")
+
+
+def _samples(t, sample_rate):
+    return round(t * sample_rate)
+
+
+def plan_segment_samples(seg, sample_rate):
+    s0, s1, s2, s3 = (_samples(seg[k], sample_rate) for k in ('start', 'start_split', 'end_split', 'end'))
+    seg['sample_rate'] = sample_rate
+    seg['audio_samples'] = (s1 - s0, s2 - s1, s3 - s2)
+
+
+def plan_edges(segments, place, fade_duration):
+    """Планирует рендер краёв с затуханием; формат задач совпадает с видео-переходами."""
+    edges = []
+    for i, seg in enumerate(segments):
+        fade_in_samples, _, fade_out_samples = seg['audio_samples']
+        seg['audio_fade_in_path'] = place(f"part{i+1}_audio_fade_in.wav", tempstore.estimate_bytes('audio', fade_in_samples / seg['sample_rate'], seg))
+        seg['audio_fade_out_path'] = place(f"part{i+1}_audio_fade_out.wav", tempstore.estimate_bytes('audio', fade_out_samples / seg['sample_rate'], seg))
+        fade_out_start = (fade_out_samples / seg['sample_rate']) - fade_duration
+        for tag, path_key, start, samples, fade in (
+            ('fade-in', 'audio_fade_in_path', seg['start'], fade_in_samples, f"afade=t=in:st=0:d={fade_duration}"),
+            ('fade-out', 'audio_fade_out_path', seg['end_split'], fade_out_samples, f"afade=t=out:st={fade_out_start:.6f}:d={fade_duration}"),
+        ):
+            edges.append({
+                'tag': f"part{i+1} audio {tag}", 'title': f"Звук: {tag} (сегмент {i+1})", 'output': seg[path_key],
+                'duration': samples / seg['sample_rate'], 'segment': seg, 'path_key': path_key, 'inputs': [seg['audio']],
+                'command': ['ffmpeg','-hide_banner','-loglevel','error','-stats','-ss', str(start), '-t', f"{samples / seg['sample_rate'] + BODY_READ_MARGIN:.6f}", '-i', seg['audio'], '-vn',
+                            '-af', f"atrim=end_sample={samples},apad=whole_len={samples},asetpts=PTS-STARTPTS,{fade}",
+                            '-ar', str(seg['sample_rate']), '-c:a', EDGE_CODEC, seg[path_key], '-y'],
+            })
+    return transitions.with_cache_keys(edges)
+
+
+def build_final_inputs(segments, intro_path, first_input_index=1):
+    """Возвращает (аргументы -i, filter_complex, метку выхода) для финальной сборки звука."""
+    inputs = ['-i', intro_path]
+    concat_inputs = f"[{first_input_index}:a]"
+    filters = []
+    idx = first_input_index + 1
+    for i, seg in enumerate(segments):
+        body_samples = seg['audio_samples'][1]
+        body_duration = body_samples / seg['sample_rate'] + BODY_READ_MARGIN
+        inputs += ['-i', seg['audio_fade_in_path'],
+                   '-ss', str(seg['start_split']), '-t', f"{body_duration:.6f}", '-i', seg['audio'],
+                   '-i', seg['audio_fade_out_path']]
+        filters.append(f"[{idx+1}:a]atrim=end_sample={body_samples},asetpts=PTS-STARTPTS[aud{i}mb]")
+        concat_inputs += f"[{idx}:a][aud{i}mb][{idx+2}:a]"
+        idx += 3
+    filters.append(f"{concat_inputs}concat=n={1 + 3 * len(segments)}:v=0:a=1[fa]")
+    return inputs, ";".join(filters), "[fa]"
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pipeline
+import tempstore
+
+# ==============================================================================
+# ---                     ПАКЕТНЫЙ (БЕЗГОЛОВЫЙ) РЕЖИМ                          ---
+# ==============================================================================
+# Запуск: python batch.py lectures.json [--workers N] [--summary путь]
+#
+# Манифест — JSON (список заданий или {"jobs": [...]}) или CSV с заголовком.
+# Поля задания те же, что отправляет веб-интерфейс: video1, video2, audio1,
+# audio2, start1, end1, start2, end2, mode, is_single_segment, intro_resolution,
+# intro_file, use_ram, use_cache, audio_codec, transition_workers; необязательное
+# поле id задаёт имя задания в сводке. В CSV все значения — строки: логические и
+# числовые поля приводятся к типам, которые ждёт pipeline.handle_processing.
+# Вместо video1..end2 в JSON можно указать список segments из любого числа
+# сегментов: [{"video": ..., "audio": ..., "start": ..., "end": ...}, ...].
+# Сводка пишется после каждого задания; при повторном запуске задания со
+# статусом "done" пропускаются, так что прерванный прогон можно продолжить.
+DEFAULT_WORKERS = os.cpu_count() or 1
+BOOL_FIELDS = ('is_single_segment', 'use_ram', 'use_cache')
+INT_FIELDS = ('transition_workers',)
+
+
+def load_manifest(path):
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            jobs = [{k: v for k, v in row.items() if v not in (None, '')} for row in csv.DictReader(f)]
+        for n, job in enumerate(jobs, 1):
+            for field in BOOL_FIELDS:
+                if field in job: job[field] = job[field].strip().lower() in ('1', 'true', 'yes', 'да')
+            for field in INT_FIELDS:
+                if field not in job: continue
+                try: job[field] = int(job[field])
+                except ValueError: raise ValueError(f"Задание {n} в манифесте: {field} должно быть целым числом, а не «{job[field]}»")
+    else:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        jobs = data['jobs'] if isinstance(data, dict) else data
+    for i, job in enumerate(jobs):
+        first_video = job.get('video1') or next((seg.get('video') for seg in job.get('segments') or [] if seg.get('video')), None)
+        if not first_video: raise ValueError(f"Задание {i+1} в манифесте: не указан video1 или segments")
+        if not job.get('segments'): job.setdefault('mode', 'two' if job.get('video2') else 'single')
+        job.setdefault('id', f"{i+1:03d}_{os.path.splitext(os.path.basename(first_video))[0]}")
+    ids = [job['id'] for job in jobs]
+    if len(set(ids)) != len(ids): raise ValueError("Повторяющиеся id заданий в манифесте")
+    return jobs
+
+
+def load_summary(path):
+    if not os.path.exists(path): return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_summary(path, summary):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class ConsoleChannel:
+    """Печатает сообщения конвейера в консоль с префиксом задания."""
+    def __init__(self, job_id):
+        self._prefix = f"[{job_id}]"
+        self._last_percent = {}
+        self.report = None
+
+    async def send(self, message):
+        data = json.loads(message)
+        action = data.get('action')
+        if action == 'log':
+            for line in data['message'].split('\n'):
+                if line.strip(): print(self._prefix, line, flush=True)
+        elif action == 'log_batch':
+            for line in data['lines']: print(self._prefix, line, flush=True)
+        elif action == 'metrics':
+            self.report = data['report']
+        elif action == 'progress' and data.get('percent') is not None:
+            # В консоль — только каждые 10% и завершение, чтобы не засорять вывод.
+            step = int(data['percent'] // 10)
+            if data['done'] or step > self._last_percent.get(data['tag'], -1):
+                self._last_percent[data['tag']] = step
+                print(self._prefix, f"[{data['tag']}] {data['percent']:.0f}%", flush=True)
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_job(job):
+    """Выполняется в процессе пула: прогоняет одно задание через конвейер."""
+    params = {k: v for k, v in job.items() if k != 'id'}
+    started, cpu_before = time.time(), _children_cpu()
+    result = {'status': 'done', 'started': started, 'output': None, 'error': None}
+    channel = ConsoleChannel(job['id'])
+    try:
+        result['output'] = asyncio.run(pipeline.handle_processing(channel, params, job_id=job['id']))
+    except Exception as e:
+        result['status'], result['error'] = 'failed', str(e)
+    if channel.report:
+        result['stages'] = {s['name']: {k: s[k] for k in ('wall_s', 'cpu_s', 'max_rss_kb', 'read_bytes', 'write_bytes')} for s in channel.report['stages']}
+        result['temp'] = channel.report.get('temp')
+    result['finished'] = time.time()
+    result['wall_time'] = result['finished'] - started
+    result['cpu_time'] = _children_cpu() - cpu_before
+    return result
+
+
+async def _prepare_intros(jobs):
+    # Интро — общий файл: готовим его до запуска пула, чтобы процессы не рендерили его наперегонки.
+    seen = set()
+    cache = pipeline.open_render_cache({})
+    for job in jobs:
+        key = (job.get('intro_resolution', '2k'), job.get('intro_file'))
+        if key in seen: continue
+        seen.add(key)
+        await pipeline.prepare_intro(ConsoleChannel('intro'), job, cache if job.get('use_cache') is not False else None)
+
+
+def print_summary(jobs, summary):
+    print("\n" + "=" * 78)
+    print(f"{'Задание':<36} {'Статус':<8} {'Время':>10} {'CPU ffmpeg':>12}")
+    print("-" * 78)
+    for job in jobs:
+        entry = summary.get(job['id'], {})
+        wall, cpu = entry.get('wall_time'), entry.get('cpu_time')
+        print(f"{job['id'][:36]:<36} {entry.get('status', '—'):<8} "
+              f"{(f'{wall:.1f} с' if wall is not None else '—'):>10} {(f'{cpu:.1f} с' if cpu is not None else '—'):>12}")
+        if entry.get('error'): print(f"    ошибка: {entry['error']}")
+    print("=" * 78)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная обработка лекций без веб-интерфейса.")
+    parser.add_argument('manifest', help="JSON- или CSV-манифест заданий")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="число одновременно обрабатываемых лекций")
+    parser.add_argument('--summary', help="файл сводки (по умолчанию <манифест>.summary.json)")
+    parser.add_argument('--rerun', action='store_true', help="заново обработать и уже завершённые задания")
+    parser.add_argument('--trace-dir', help="сохранять Chrome trace каждого задания в этот каталог")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    for path in tempstore.sweep_stale(): print(f"Удалена брошенная временная папка: {path}")
+    summary_path = args.summary or f"{os.path.splitext(args.manifest)[0]}.summary.json"
+    summary = {} if args.rerun else load_summary(summary_path)
+    pending = [job for job in jobs if summary.get(job['id'], {}).get('status') != 'done']
+    print(f"Заданий в манифесте: {len(jobs)}, к выполнению: {len(pending)}, уже готово: {len(jobs) - len(pending)}")
+
+    if pending:
+        workers = max(1, min(args.workers, len(pending)))
+        # Ядра делятся между лекциями: каждой достаётся своя доля пула переходов.
+        transition_workers = max(1, DEFAULT_WORKERS // workers)
+        for job in pending:
+            job.setdefault('transition_workers', transition_workers)
+            if args.trace_dir: job.setdefault('trace_dir', os.path.abspath(args.trace_dir))
+        try:
+            asyncio.run(_prepare_intros(pending))
+        except Exception as e:
+            print(f"КРИТИЧЕСКАЯ ОШИБКА при подготовке интро: {e}", file=sys.stderr)
+            return 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_job, job): job for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                try: summary[job['id']] = future.result()
+                except Exception as e: summary[job['id']] = {'status': 'failed', 'error': str(e)}
+                save_summary(summary_path, summary)
+                print(f"[{job['id']}] {summary[job['id']]['status']}", flush=True)
+
+    print_summary(jobs, summary)
+    print(f"Сводка: {summary_path}")
+    return 0 if all(summary.get(job['id'], {}).get('status') == 'done' for job in jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
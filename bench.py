@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import audio
+import batch
+import keyframes
+import pipeline
+import tempstore
+import timeline
+import transitions
+
+# ==============================================================================
+# ---                    БЕНЧМАРК КОНВЕЙЕРА НА СИНТЕТИКЕ                       ---
+# ==============================================================================
+# Запуск: python bench.py [--duration 600] [--resolution 1920x1080] [--fps 60]
+#                         [--gop 120] [--segments 3] [--repeat 3] [--compare old.json]
+#
+# Исходники генерируются локально через lavfi (testsrc2 + sine) и переиспользуются
+# между прогонами с теми же параметрами. Этапы конвейера прогоняются по очереди:
+# индекс I-кадров, рендер переходов, звуковой граф, финальная concat-сборка.
+# Для каждого этапа пишутся время, CPU (своё и дочерних ffmpeg), пиковый RSS
+# дочерних процессов, записанные байты и максимум занятого места во временной
+# папке. Кэш рендеров не используется — меряется полная работа.
+RESULTS_VERSION = 1
+DEFAULT_WORK_DIR = "bench_work"
+INTRO_DURATION = 5.0
+SAMPLE_INTERVAL = 0.2   # период опроса временной папки и дочерних процессов, с
+STAGES = ('keyframe_index', 'transitions', 'audio', 'concat')
+
+
+def _child_peak_rss_kb():
+    """Максимальный VmHWM среди живых дочерних процессов (только Linux)."""
+    peak, me = 0, os.getpid()
+    try: pids = [p for p in os.listdir('/proc') if p.isdigit()]
+    except FileNotFoundError: return 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                if int(f.read().rsplit(')', 1)[1].split()[1]) != me: continue
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'): peak = max(peak, int(line.split()[1]))
+        except (OSError, IndexError, ValueError):
+            continue
+    return peak
+
+
+class StageMeter:
+    """Меряет один этап; пока этап идёт, в фоне опрашивает временную папку и дочерние процессы."""
+    def __init__(self, store, interval=SAMPLE_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self.outputs = []
+        self.result = None
+
+    def _sample(self):
+        self._temp_peak = max(self._temp_peak, sum(tempstore.dir_size(d) for d in self.store.dirs()))
+        self._rss_peak = max(self._rss_peak, _child_peak_rss_kb())
+
+    async def _sampler(self):
+        while True:
+            await asyncio.to_thread(self._sample)
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        self._temp_peak = self._rss_peak = 0
+        self._self0 = resource.getrusage(resource.RUSAGE_SELF)
+        self._children0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._t0 = time.perf_counter()
+        self._task = asyncio.create_task(self._sampler())
+        return self
+
+    async def __aexit__(self, *exc):
+        wall = time.perf_counter() - self._t0
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._sample()
+        self1 = resource.getrusage(resource.RUSAGE_SELF)
+        children1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        # ru_maxrss дочерних — максимум за всю жизнь процесса; учитываем его, только если он вырос на этом этапе.
+        child_maxrss = children1.ru_maxrss if children1.ru_maxrss > self._children0.ru_maxrss else 0
+        self.result = {
+            'wall_s': wall,
+            'cpu_user_s': (self1.ru_utime - self._self0.ru_utime) + (children1.ru_utime - self._children0.ru_utime),
+            'cpu_sys_s': (self1.ru_stime - self._self0.ru_stime) + (children1.ru_stime - self._children0.ru_stime),
+            'children_cpu_s': (children1.ru_utime + children1.ru_stime) - (self._children0.ru_utime + self._children0.ru_stime),
+            'peak_rss_kb': max(self._rss_peak, child_maxrss),
+            'self_rss_kb': self1.ru_maxrss,
+            'bytes_written': sum(os.path.getsize(p) for p in self.outputs if os.path.isfile(p)),
+            'temp_peak_bytes': self._temp_peak,
+        }
+        self.result['cpu_s'] = self.result['cpu_user_s'] + self.result['cpu_sys_s']
+        return False
+
+
+class QuietChannel:
+    """Канал конвейера для бенчмарка: сообщения не выводятся."""
+    async def send(self, message):
+        pass
+
+
+def parse_resolution(value):
+    try:
+        width, height = (int(x) for x in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается ШИРИНАxВЫСОТА, получено: {value}")
+    return width, height
+
+
+def ffmpeg_version():
+    try:
+        out = subprocess.run(['ffmpeg', '-hide_banner', '-version'], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.split('\n')[0]
+
+
+def source_command(path, duration, resolution, fps, gop):
+    width, height = resolution
+    return ['ffmpeg','-hide_banner','-loglevel','error','-stats',
+            '-f','lavfi','-i', f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+            '-f','lavfi','-i', f"sine=frequency=440:beep_factor=4:sample_rate=48000:duration={duration}",
+            '-c:v', pipeline.VIDEO_ENCODER, '-preset','ultrafast', '-pix_fmt','yuv420p',
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold','0',
+            '-c:a','aac','-b:a','192k', '-shortest', path, '-y']
+
+
+async def generate_media(channel, work_dir, args):
+    """Создаёт (или переиспользует) синтетические исходник и интро; возвращает их пути."""
+    width, height = args.resolution
+    name = f"src_{width}x{height}_{args.fps}fps_g{args.gop}_{args.duration:g}s"
+    paths = {'source': os.path.join(work_dir, f"{name}.mkv"),
+             'intro': os.path.join(work_dir, f"intro_{width}x{height}_{args.fps}fps.mkv")}
+    for key, duration in (('source', args.duration), ('intro', INTRO_DURATION)):
+        path = paths[key]
+        if os.path.exists(path) and not args.regenerate: continue
+        started = time.perf_counter()
+        await pipeline.run_async_command(channel, source_command(path, duration, args.resolution, args.fps, args.gop),
+                                         f"Генерация {os.path.basename(path)}", duration=duration)
+        print(f"Сгенерирован {path} за {time.perf_counter() - started:.1f} с", flush=True)
+    return paths
+
+
+def plan_segments(source, duration, count):
+    """Делит исходник на `count` равных слотов и берёт из каждого середину (90%)."""
+    slot = duration / count
+    raw = [{'video': source, 'start': f"{slot * i + slot * 0.05:.3f}", 'end': f"{slot * (i + 1) - slot * 0.05:.3f}"} for i in range(count)]
+    segments = timeline.segments_from_params({'segments': raw})
+    errors = timeline.validate_segments(segments, pipeline.FADE_DURATION)
+    if errors: raise ValueError("Синтетический таймлайн некорректен:\n" + "\n".join(errors))
+    for seg in segments:
+        seg['video'], seg['audio'], seg['remux'] = seg['video_orig'], seg['audio_orig'], 'direct'
+    return segments
+
+
+async def run_once(channel, media, args, store, output_path):
+    """Один проход всех этапов; возвращает {этап: метрики}."""
+    results = {}
+    run = lambda cmd, title, tag, duration: pipeline.run_async_command(channel, cmd, title, tag, duration)
+    segments = plan_segments(media['source'], args.duration, args.segments)
+
+    async with StageMeter(store) as meter:
+        for path in (media['source'], media['intro']):
+            index_path = keyframes.index_path_for(path)
+            if os.path.exists(index_path): os.remove(index_path)
+            (await keyframes.build_index(path, method=args.index_method)).close()
+            meter.outputs.append(index_path)
+    results['keyframe_index'] = meter.result
+
+    sample_rate = await audio.probe_sample_rate(media['source'])
+    for i, seg in enumerate(segments):
+        with await keyframes.open_index(seg['video']) as index:
+            seg['start_split'] = index.first_after(seg['start'] + pipeline.FADE_DURATION)
+            seg['end_split'] = index.last_before(seg['end'] - pipeline.FADE_DURATION)
+        error = timeline.validate_split_points(seg, i)
+        if error: raise ValueError(f"{error} Уменьшите --gop или --segments.")
+        audio.plan_segment_samples(seg, sample_rate)
+        seg['video_bitrate'] = await keyframes.probe_bit_rate(seg['video'])
+
+    async with StageMeter(store) as meter:
+        plan = transitions.plan_transitions(segments, store.place, pipeline.FADE_DURATION, pipeline.VIDEO_ENCODER)
+        await transitions.render_transitions(plan, run, args.workers)
+        store.settle()
+        meter.outputs.extend(t['output'] for t in plan)
+    results['transitions'] = meter.result
+
+    async with StageMeter(store) as meter:
+        edges = audio.plan_edges(segments, store.place, pipeline.FADE_DURATION)
+        await transitions.render_transitions(edges, run, args.workers)
+        store.settle()
+        meter.outputs.extend(t['output'] for t in edges)
+    results['audio'] = meter.result
+
+    async with StageMeter(store) as meter:
+        concat_parts = [f"file '{media['intro']}'"]
+        for seg in segments:
+            concat_parts += [f"file '{seg['fade_in_path']}'", f"file '{seg['video']}'\ninpoint {seg['start_split']}\noutpoint {seg['end_split']}", f"file '{seg['fade_out_path']}'"]
+        concat_path = store.place("concat.txt", tempstore.estimate_bytes('text', 0))
+        with open(concat_path, 'w', encoding='utf-8') as f: f.write("\n".join(concat_parts))
+        final_args = ['-c:v','copy','-r', str(args.fps)] + audio.codec_args(args.audio_codec)
+        command, _ = pipeline.build_final_command(concat_path, segments, media['intro'], final_args, output_path)
+        await run(command, "Финальная сборка", "concat", INTRO_DURATION + sum(seg['end'] - seg['start'] for seg in segments))
+        meter.outputs.append(output_path)
+    results['concat'] = meter.result
+    return results
+
+
+def aggregate(runs):
+    """Сводит повторы: время и CPU — медиана, память и место — максимум."""
+    stages = {}
+    for stage in STAGES:
+        samples = [run[stage] for run in runs]
+        stages[stage] = {key: (statistics.median if key.endswith('_s') else max)(s[key] for s in samples) for key in samples[0]}
+    stages['total'] = {key: (sum if key.endswith('_s') or key == 'bytes_written' else max)(stages[s][key] for s in STAGES)
+                       for key in stages[STAGES[0]]}
+    return stages
+
+
+def compare(previous, current, threshold):
+    """Печатает разницу с прошлым результатом; возвращает этапы, замедлившиеся больше порога (%)."""
+    if previous.get('params') != current['params']:
+        print("ВНИМАНИЕ: параметры прогонов различаются, сравнение может быть некорректным.")
+    print(f"\n{'Этап':<16} {'Время, с':>22} {'CPU, с':>22} {'Пик RSS, МБ':>20} {'Врем. место, МБ':>20}")
+    print("-" * 104)
+    regressions = []
+    for stage in STAGES + ('total',):
+        old, new = previous['stages'].get(stage), current['stages'][stage]
+        if not old:
+            print(f"{stage:<16} {'нет в прошлом результате':>22}"); continue
+        cells = []
+        for key, scale in (('wall_s', 1), ('cpu_s', 1), ('peak_rss_kb', 1024), ('temp_peak_bytes', 1024**2)):
+            a, b = old[key] / scale, new[key] / scale
+            delta = (b - a) / a * 100 if a else 0.0
+            cells.append(f"{a:.1f} → {b:.1f} ({delta:+.0f}%)")
+            if key == 'wall_s' and threshold is not None and delta > threshold: regressions.append(stage)
+        print(f"{stage:<16} " + " ".join(f"{c:>22}" if i < 2 else f"{c:>20}" for i, c in enumerate(cells)))
+    return regressions
+
+
+def print_results(stages):
+    print(f"\n{'Этап':<16} {'Время, с':>10} {'CPU, с':>10} {'Пик RSS, МБ':>12} {'Записано, МБ':>13} {'Врем. место, МБ':>16}")
+    print("-" * 82)
+    for stage in STAGES + ('total',):
+        r = stages[stage]
+        print(f"{stage:<16} {r['wall_s']:>10.2f} {r['cpu_s']:>10.2f} {r['peak_rss_kb'] / 1024:>12.1f} "
+              f"{r['bytes_written'] / 1024**2:>13.1f} {r['temp_peak_bytes'] / 1024**2:>16.1f}")
+
+
+async def run_bench(args):
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    channel = batch.ConsoleChannel('bench') if args.verbose else QuietChannel()
+    media = await generate_media(channel, work_dir, args)
+    tempstore.sweep_stale((tempstore.RAM_DIR, work_dir))
+    runs = []
+    for n in range(args.repeat):
+        # Временные файлы размещаются так же, как в редакторе: RAM-диск с запасом или диск.
+        store = tempstore.TempStore(f"bench_{n+1}", args.use_ram, disk_root=work_dir)
+        output_path = os.path.join(work_dir, "bench_final_edit.mkv")
+        try:
+            runs.append(await run_once(channel, media, args, store, output_path))
+        finally:
+            store.cleanup()
+            if os.path.exists(output_path): os.remove(output_path)
+        print(f"Прогон {n+1}/{args.repeat}: {sum(runs[-1][s]['wall_s'] for s in STAGES):.1f} с", flush=True)
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов конвейера на синтетических исходниках.")
+    parser.add_argument('--duration', type=timeline.hms_to_seconds, default=600.0, help="длина исходника (секунды или ЧЧ:ММ:СС)")
+    parser.add_argument('--resolution', type=parse_resolution, default=(1920, 1080), help="разрешение, например 2560x1440")
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--gop', type=int, default=120, help="расстояние между I-кадрами, в кадрах")
+    parser.add_argument('--segments', type=int, default=3, help="число сегментов таймлайна")
+    parser.add_argument('--workers', type=int, default=transitions.DEFAULT_WORKERS, help="одновременных рендеров переходов")
+    parser.add_argument('--index-method', default=keyframes.INDEX_METHOD, choices=('packets', 'frames'),
+                        help="как строить индекс I-кадров: обход пакетов или декодирование ключевых кадров")
+    parser.add_argument('--audio-codec', default=pipeline.FINAL_AUDIO_CODEC, choices=sorted(audio.AUDIO_CODEC_OPTIONS))
+    parser.add_argument('--repeat', type=int, default=1, help="число прогонов (время — медиана)")
+    parser.add_argument('--use-ram', action='store_true', help="временные файлы в /dev/shm, как в интерфейсе")
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help="папка для исходников и результатов")
+    parser.add_argument('--regenerate', action='store_true', help="заново сгенерировать исходники")
+    parser.add_argument('--output', help="файл результатов (по умолчанию <work-dir>/bench-<время>.json)")
+    parser.add_argument('--compare', help="прошлый файл результатов для сравнения")
+    parser.add_argument('--max-regression', type=float, help="код выхода 1, если время этапа выросло больше чем на N%%")
+    parser.add_argument('--verbose', action='store_true', help="печатать журнал ffmpeg")
+    args = parser.parse_args(argv)
+
+    version = ffmpeg_version()
+    if not version:
+        print("ffmpeg не найден в PATH", file=sys.stderr)
+        return 2
+    try:
+        runs = asyncio.run(run_bench(args))
+    except Exception as e:
+        print(f"КРИТИЧЕСКАЯ ОШИБКА: {e}", file=sys.stderr)
+        return 1
+
+    width, height = args.resolution
+    results = {
+        'version': RESULTS_VERSION,
+        'created': time.time(),
+        'params': {'duration': args.duration, 'resolution': f"{width}x{height}", 'fps': args.fps, 'gop': args.gop,
+                   'segments': args.segments, 'workers': args.workers, 'audio_codec': args.audio_codec,
+                   'use_ram': args.use_ram, 'index_method': args.index_method, 'encoder': pipeline.VIDEO_ENCODER, 'fade_duration': pipeline.FADE_DURATION},
+        'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                 'cpu_count': os.cpu_count(), 'ffmpeg': version},
+        'stages': aggregate(runs),
+        'runs': runs,
+    }
+    print_results(results['stages'])
+    output = args.output or os.path.join(args.work_dir, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), results, args.max_regression)
+        if regressions:
+            print(f"\nЗамедление больше {args.max_regression:g}%: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,23 @@
 import asyncio
 import json
-import os
 import http
-import subprocess
 import webbrowser
 from tkinter import Tk, filedialog
 import websockets
 from websockets.server import serve
 
+import analysis
+import jobs
+import preview
+import tempstore
+from pipeline import FADE_DURATION, handle_processing, run_async_command
+
 # ==============================================================================
 # ---                        ГЛАВНЫЕ НАСТРОЙКИ                                ---
 # ==============================================================================
-FADE_DURATION = 1.0
-DEFAULT_INTRO_DIR = os.path.realpath("..")
-INTRO_BASE_NAME = "intro_new_sponsored"
-VIDEO_ENCODER = "libx264"
-FINAL_AUDIO_CODEC = "pcm_s16le"
+# Настройки обработки (длительность переходов, энкодер, интро) — в pipeline.py.
 SERVER_PORT = 8765
+MAX_CONCURRENT_JOBS = jobs.MAX_CONCURRENT_JOBS   # Сколько заданий из очереди выполнять одновременно
 
 HTML_CONTENT = """
 <!DOCTYPE html>
@@ -31,6 +32,7 @@ HTML_CONTENT = """
         .form-column { flex: 1; min-width: 400px; } 
         .preview-column { flex: 2; min-width: 400px;}
         h1, h2 { color: var(--accent-green); border-bottom: 2px solid var(--panel-bg); }
+        select { padding: 6px; background: var(--panel-bg); color: var(--main-fg); border: 1px solid var(--border-color); border-radius: 4px; }
         input[type="text"] { flex-grow: 1; padding: 8px; background: var(--panel-bg); color: var(--main-fg); border: 1px solid var(--border-color); border-radius: 4px; box-sizing: border-box; }
         button { background-color: var(--border-color); color: var(--main-fg); border: none; padding: 8px; border-radius: 4px; cursor: pointer; transition: background-color 0.2s; width: 100%; margin-bottom: 10px; }
         button:hover { background-color: var(--accent-purple); }
@@ -43,6 +45,31 @@ HTML_CONTENT = """
         #log-output { background: var(--log-bg); border: 1px solid var(--panel-bg); height: 400px; overflow-y: scroll; white-space: pre-wrap; font-family: monospace; }
         .hidden { display: none; }
         .time-input-group { display: flex; align-items: center; margin-bottom: 10px; }
+        .job-row { display: flex; align-items: center; gap: 8px; padding: 4px 8px; border-bottom: 1px solid var(--panel-bg); font-family: monospace; cursor: pointer; }
+        .job-row span.path { flex-grow: 1; word-break: break-all; }
+        .job-row button { width: auto; margin: 0; padding: 4px 8px; }
+        .job-running { color: var(--accent-green); } .job-failed { color: var(--accent-pink); } .job-cancelled, .job-done { opacity: 0.6; }
+        .progress-row { display: flex; align-items: center; gap: 8px; font-family: monospace; margin: 4px 0; }
+        .progress-row progress { flex-grow: 1; accent-color: var(--accent-green); }
+        .progress-label { min-width: 160px; color: var(--accent-purple); }
+        #preview-status { font-family: monospace; color: var(--accent-purple); min-height: 1.2em; }
+        #thumb-strip { display: flex; overflow-x: auto; gap: 2px; padding: 4px 0; }
+        .thumb { flex-shrink: 0; cursor: pointer; border: 1px solid var(--panel-bg); position: relative; }
+        .thumb:hover { border-color: var(--accent-green); }
+        .thumb span { position: absolute; left: 2px; bottom: 1px; font-size: 10px; font-family: monospace; background: rgba(0,0,0,0.6); }
+        #suggestions { font-family: monospace; margin: 6px 0; }
+        .break-row { display: flex; align-items: center; gap: 6px; padding: 2px 0; cursor: pointer; }
+        .break-row input { flex-shrink: 0; }
+        #suggestions button { margin-top: 6px; }
+        .take-btn { width: 40px; height: 38px; padding: 0; margin: 0 0 0 5px; flex-shrink: 0; }
+        .stage-bar { display: flex; height: 18px; margin: 6px 0; border: 1px solid var(--panel-bg); }
+        .stage-bar div { height: 100%; min-width: 2px; }
+        .stage-table { width: 100%; font-family: monospace; border-collapse: collapse; }
+        .stage-table td, .stage-table th { padding: 2px 6px; text-align: right; border-bottom: 1px solid var(--panel-bg); }
+        .stage-table td:first-child, .stage-table th:first-child { text-align: left; }
+        .segment { border-bottom: 1px solid var(--panel-bg); padding-bottom: 10px; margin-bottom: 10px; }
+        .segment-header { display: flex; align-items: center; justify-content: space-between; }
+        .segment-header button { width: auto; margin: 0; padding: 4px 10px; }
         .file-path-display { padding: 8px; background: #333; border-radius: 4px; min-height: 1.2em; word-break: break-all; margin-top: 5px; margin-bottom: 10px; }
     </style>
 </head>
@@ -51,18 +78,7 @@ HTML_CONTENT = """
      <div class="container">
         <div class="form-column">
             <fieldset><legend>1. Настройки</legend>
-                <label>Режим Работы:</label>
                 <div>
-                    <input type="radio" id="singleFile" name="mode" value="single" checked onchange="toggleMode()"> 
-                    <label for="singleFile" title="Обработать два сегмента из одного и того же видео/аудио файла.">Один файл</label>
-                    <input type="radio" id="twoFiles" name="mode" value="two" onchange="toggleMode()"> 
-                    <label for="twoFiles" title="Обработать два сегмента из двух разных видео/аудио файлов.">Два файла</label>
-                </div>
-                <div id="single_segment_toggle_div" style="margin-top:10px;">
-                    <input type="checkbox" id="is_single_segment" name="is_single_segment" onchange="toggleMode()"> 
-                    <label for="is_single_segment" title="Вырезать один непрерывный кусок из видео, добавив интро и плавные переходы в начале и конце.">Обработать как единый ролик</label>
-                </div>
-                <div style="margin-top:15px;">
                     <input type="checkbox" id="use_ram" checked> 
                     <label for="use_ram" title="Временные файлы будут созданы в /dev/shm (ОЗУ). Работает только на Linux. Ускоряет процесс, если достаточно ОЗУ.">Использовать RAM-диск</label>
                 </div>
@@ -73,99 +89,282 @@ HTML_CONTENT = """
                       <input type="radio" id="intro_2k" name="intro_resolution" value="2k" checked> <label for="intro_2k">2K (1440p)</label>
                     </div>
                 </div>
+                <div style="margin-top:15px;">
+                    <label for="audio_codec" title="Кодек итоговой звуковой дорожки. PCM — без сжатия (очень большой файл), FLAC — без потерь со сжатием.">Аудиокодек:</label>
+                    <select id="audio_codec">
+                      <option value="pcm_s16le" selected>PCM 16 бит (без сжатия)</option>
+                      <option value="flac">FLAC (без потерь)</option>
+                      <option value="aac">AAC 256k</option>
+                      <option value="libopus">Opus 160k</option>
+                    </select>
+                </div>
             </fieldset>
-            <fieldset><legend>2. Файлы</legend>
-                <button type="button" onclick="selectFile('intro_file')">1. Выбрать исходник интро (если нужно)</button><div id="intro_file_path" class="file-path-display"></div>
-                <button type="button" onclick="selectFile('video1')">2. Выбрать Видео 1</button><div id="video1_path" class="file-path-display"></div>
-                <div id="video2_container" class="hidden"><button type="button" onclick="selectFile('video2')">3. Выбрать Видео 2</button><div id="video2_path" class="file-path-display"></div></div>
-                <button type="button" onclick="selectFile('audio1')">Аудио 1 (опция)...</button><div id="audio1_path" class="file-path-display"></div>
-                <div id="audio2_container" class="hidden"><button type="button" onclick="selectFile('audio2')">Аудио 2 (опция)...</button><div id="audio2_path" class="file-path-display"></div></div>
+            <fieldset><legend>2. Интро</legend>
+                <button type="button" onclick="selectFile('intro_file')">Выбрать исходник интро (если нужно)</button><div id="intro_file_path" class="file-path-display"></div>
             </fieldset>
-             <fieldset><legend>3. Таймкоды</legend>
-                <h4>Сегмент 1</h4>
-                <div class="time-input-group"><label for="start1" style="width:60px;">Начало:</label> <input type="text" id="start1" placeholder="00:01:10"><button class="jump-btn" onclick="jumpToTime('start1')">▶</button></div>
-                <div class="time-input-group"><label for="end1" style="width:60px;">Конец:</label> <input type="text" id="end1" placeholder="00:45:30"><button class="jump-btn" onclick="jumpToTime('end1')">▶</button></div>
-                <div id="part2_timecodes" class="hidden"><hr style="border-color: var(--panel-bg);"><h4>Сегмент 2</h4>
-                    <div class="time-input-group"><label for="start2" style="width:60px;">Начало:</label> <input type="text" id="start2" placeholder="00:00:15"><button class="jump-btn" onclick="jumpToTime('start2')">▶</button></div>
-                    <div class="time-input-group"><label for="end2" style="width:60px;">Конец:</label> <input type="text" id="end2" placeholder="00:30:00"><button class="jump-btn" onclick="jumpToTime('end2')">▶</button></div>
-                </div>
+            <fieldset><legend>3. Сегменты</legend>
+                <div id="segments"></div>
+                <button type="button" onclick="addSegment()" title="Новый сегмент по умолчанию берётся из того же видео, что и предыдущий.">+ Добавить сегмент</button>
             </fieldset>
             <button type="button" id="submitBtn" class="action-btn" onclick="submitForm()">Начать Обработку</button>
         </div>
-        <div class="preview-column"><h2>Предпросмотр</h2><video id="videoPreview" controls></video><h2>Лог выполнения</h2><pre id="log-output">Ожидание подключения к серверу...</pre></div>
+        <div class="preview-column"><h2>Предпросмотр</h2><video id="videoPreview" controls preload="metadata"></video><div id="preview-status"></div><div id="thumb-strip"></div><div id="suggestions"></div><h2>Очередь заданий</h2><div id="job-list"></div><div id="progress-panel"></div><div id="metrics-panel"></div><h2>Лог выполнения</h2><pre id="log-output">Ожидание подключения к серверу...</pre></div>
     </div>
     <script>
         const logOutput = document.getElementById('log-output');
-        let filePaths = { video1: '', video2: '', audio1: '', audio2: '', intro_file: '' };
+        // Журнал — ограниченный буфер строк; DOM перерисовывается не чаще одного раза за кадр.
+        const LOG_MAX_LINES = 2000;
+        let logLines = [], logRenderPending = false;
+        function renderLog() { logRenderPending = false; logOutput.textContent = logLines.join('\\n') + '\\n'; logOutput.scrollTop = logOutput.scrollHeight; }
+        function scheduleLogRender() { if (!logRenderPending) { logRenderPending = true; requestAnimationFrame(renderLog); } }
+        function appendLog(...lines) {
+            lines.forEach(l => logLines.push(...String(l).split('\\n')));
+            if (logLines.length > LOG_MAX_LINES) logLines.splice(0, logLines.length - LOG_MAX_LINES);
+            scheduleLogRender();
+        }
+        function setLog(text) { logLines = []; appendLog(text); }
+        let progressRows = {};
+        function fmtSeconds(s) { if (s === null || s === undefined) return '—'; s = Math.round(s); return `${Math.floor(s / 3600)}:${String(Math.floor(s / 60) % 60).padStart(2, '0')}:${String(s % 60).padStart(2, '0')}`; }
+        function updateProgress(data) {
+            const key = (data.job_id || '') + '|' + data.tag;
+            let row = progressRows[key];
+            if (!row) {
+                row = document.createElement('div'); row.className = 'progress-row';
+                row.innerHTML = '<span class="progress-label"></span><progress max="100"></progress><span class="progress-text"></span>';
+                document.getElementById('progress-panel').append(row); progressRows[key] = row;
+            }
+            row.querySelector('.progress-label').textContent = (data.job_id ? `#${data.job_id} ` : '') + data.tag;
+            const bar = row.querySelector('progress');
+            if (data.percent === null) bar.removeAttribute('value'); else bar.value = data.percent;
+            row.querySelector('.progress-text').textContent = [data.percent === null ? '' : data.percent.toFixed(1) + '%', 'время ' + fmtSeconds(data.out_time),
+                data.speed ? data.speed + 'x' : '', data.fps ? data.fps + ' fps' : '', 'осталось ' + fmtSeconds(data.eta)].filter(Boolean).join(' · ');
+            if (data.done) { setTimeout(() => { row.remove(); delete progressRows[key]; }, 3000); }
+        }
+        // Отчёт по этапам: полоса времени (доля каждого этапа) и таблица ресурсов.
+        const STAGE_TITLES = { prepare: 'Подготовка', segments: 'Сегменты', transitions: 'Переходы', final: 'Финальная сборка', cleanup: 'Очистка' };
+        const STAGE_COLORS = ['#50fa7b', '#bd93f9', '#ff79c6', '#8be9fd', '#ffb86c', '#6272a4'];
+        function fmtMB(bytes) { return (bytes / 1048576).toFixed(0); }
+        function renderMetrics(report) {
+            const panel = document.getElementById('metrics-panel'); panel.innerHTML = '';
+            if (!report) return;
+            const title = document.createElement('h2'); title.textContent = `Этапы задания${report.job_id ? ' #' + report.job_id : ''}: ${report.wall_s.toFixed(1)} с`;
+            const bar = document.createElement('div'); bar.className = 'stage-bar';
+            const table = document.createElement('table'); table.className = 'stage-table';
+            table.innerHTML = '<tr><th>Этап</th><th>Время, с</th><th>ffmpeg</th><th>CPU, с</th><th>Пик RSS, МБ</th><th>Чтение, МБ</th><th>Запись, МБ</th></tr>';
+            report.stages.forEach((stage, i) => {
+                const name = STAGE_TITLES[stage.name] || stage.name;
+                const part = document.createElement('div'); part.style.flexGrow = Math.max(stage.wall_s, 0.001); part.style.background = STAGE_COLORS[i % STAGE_COLORS.length];
+                part.title = `${name}: ${stage.wall_s.toFixed(1)} с`; bar.append(part);
+                const row = table.insertRow();
+                [name, stage.wall_s.toFixed(1), stage.commands, stage.cpu_s.toFixed(1), (stage.max_rss_kb / 1024).toFixed(0), fmtMB(stage.read_bytes), fmtMB(stage.write_bytes)]
+                    .forEach(v => { row.insertCell().textContent = v; });
+                row.cells[0].style.color = STAGE_COLORS[i % STAGE_COLORS.length];
+            });
+            panel.append(title, bar, table);
+            if (report.temp) {
+                const temp = document.createElement('div'); temp.className = 'path';
+                temp.textContent = `Временные файлы: пик RAM ${fmtMB(report.temp.peak_ram_bytes)} МБ, диск ${fmtMB(report.temp.peak_disk_bytes)} МБ` +
+                    (report.temp.spilled.length ? `; не поместились в RAM: ${report.temp.spilled.join(', ')}` : '');
+                panel.append(temp);
+            }
+        }
+        let filePaths = { intro_file: '' };
+        // Таймлайн: любое число сегментов; пустое видео — то же, что у предыдущего сегмента.
+        let segments = [{ video: '', audio: '', start: '', end: '' }];
         let ws;
+        let jobs = {};
+        const JOB_STATUS = { queued: 'в очереди', running: 'выполняется', done: 'готово', failed: 'ошибка', cancelled: 'отменено' };
+        function renderJobs() {
+            const list = document.getElementById('job-list'); list.innerHTML = '';
+            Object.values(jobs).sort((a, b) => a.created - b.created).forEach(job => {
+                const row = document.createElement('div'); row.className = 'job-row job-' + job.status;
+                row.title = 'Показать журнал задания'; row.onclick = () => ws.send(JSON.stringify({ action: 'job_info', job_id: job.id }));
+                const name = document.createElement('span'); name.className = 'path'; name.textContent = `#${job.id} ${job.video1.split('/').pop()}`;
+                const status = document.createElement('span'); status.textContent = JOB_STATUS[job.status] || job.status;
+                row.append(name, status);
+                if (job.status === 'queued' || job.status === 'running') {
+                    const btn = document.createElement('button'); btn.textContent = 'Отменить';
+                    btn.onclick = (e) => { e.stopPropagation(); ws.send(JSON.stringify({ action: 'cancel_job', job_id: job.id })); };
+                    row.append(btn);
+                }
+                list.append(row);
+            });
+        }
         function hmsToSeconds(str){if(!str)return 0;const p=str.split(':').map(Number);let s=0;if(p.length===3)s=p[0]*3600+p[1]*60+p[2];else if(p.length===2)s=p[0]*60+p[1];else if(p.length===1&&str)s=parseFloat(str);return isNaN(s)?0:s}
-        function jumpToTime(id){const i=document.getElementById(id),t=hmsToSeconds(i.value),v=document.getElementById('videoPreview');if(!isNaN(t)&&v.duration){v.currentTime=t;v.play()}}
+        function segmentVideo(idx){for(let i=idx;i>=0;i--){if(segments[i].video)return segments[i].video}return ''}
+        // Предпросмотр идёт через прокси, который сервер строит в фоне и отдаёт по HTTP (с Range).
+        let previews = {}, previewPath = '';
+        function fmtTimecode(t, digits = 2) { const h = Math.floor(t / 3600), m = Math.floor(t / 60) % 60, sec = (t % 60).toFixed(digits).padStart(digits ? digits + 3 : 2, '0'); return `${String(h).padStart(2, '0')}:${String(m).padStart(2, '0')}:${sec}`; }
+        function renderThumbs(info) {
+            const strip = document.getElementById('thumb-strip'); strip.innerHTML = '';
+            if (!info || !info.thumbs_url) return;
+            const sprite = new Image();
+            sprite.onload = () => {
+                const w = sprite.naturalWidth / info.columns, h = sprite.naturalHeight / info.rows;
+                info.times.forEach((t, i) => {
+                    const el = document.createElement('div'); el.className = 'thumb'; el.title = fmtTimecode(t);
+                    el.style.width = w + 'px'; el.style.height = h + 'px';
+                    el.style.background = `url(${info.thumbs_url}) -${(i % info.columns) * w}px -${Math.floor(i / info.columns) * h}px`;
+                    el.innerHTML = `<span>${fmtSeconds(t)}</span>`;
+                    el.onclick = () => { const v = document.getElementById('videoPreview'); v.currentTime = t; };
+                    strip.append(el);
+                });
+            };
+            sprite.src = info.thumbs_url;
+        }
+        function applyPreview(path) {
+            const info = previews[path], v = document.getElementById('videoPreview'), status = document.getElementById('preview-status');
+            if (!info || info.state === 'building') { status.textContent = 'Готовится прокси для предпросмотра...'; v.removeAttribute('src'); v.dataset.url = ''; renderThumbs(null); return; }
+            if (info.state === 'failed') { status.textContent = 'Предпросмотр недоступен: ' + (info.error || ''); renderThumbs(null); return; }
+            status.textContent = path.split('/').pop();
+            if (v.dataset.url !== info.proxy_url) { v.dataset.url = info.proxy_url; v.src = info.proxy_url; renderThumbs(info); }
+        }
+        function showPreview(path) {
+            if (!path) return;
+            if (path !== previewPath) { previewPath = path; if ((!previews[path] || previews[path].state === 'failed') && ws && ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ action: 'preview', path: path })); }
+            applyPreview(path); renderSuggestions();
+        }
+        // Подсказки точек реза: перерывы из фонового анализа, границы уже выровнены по I-кадрам.
+        let analyses = {};
+        function requestAnalysis(path) { if (path && !analyses[path] && ws && ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ action: 'analyze', path: path })); }
+        function seekPreview(t) { const v = document.getElementById('videoPreview'); if (v.dataset.url) v.currentTime = t; }
+        function renderSuggestions() {
+            const box = document.getElementById('suggestions'); box.innerHTML = '';
+            const info = analyses[previewPath];
+            if (!info) return;
+            if (info.state === 'analyzing') { box.textContent = 'Анализ тишины, громкости и смен сцены...'; return; }
+            if (info.state === 'failed') { box.textContent = 'Анализ не удался: ' + (info.error || ''); return; }
+            if (!info.breaks.length) { box.textContent = 'Перерывов не найдено.'; return; }
+            const title = document.createElement('label'); title.textContent = 'Найденные перерывы (границы по I-кадрам):'; box.append(title);
+            info.breaks.forEach(b => {
+                if (b.checked === undefined) b.checked = true;
+                const row = document.createElement('div'); row.className = 'break-row';
+                const box_ = document.createElement('input'); box_.type = 'checkbox'; box_.checked = b.checked;
+                box_.onclick = (e) => { e.stopPropagation(); b.checked = box_.checked; };
+                const text = document.createElement('span');
+                const quiet = `${fmtTimecode(b.quiet_from, 0)}–${fmtTimecode(b.quiet_to, 0)}`;
+                text.textContent = b.head ? `Начало записи: тишина ${quiet} → начать с ${fmtTimecode(b.in, 3)}`
+                    : b.tail ? `Конец записи: тишина ${quiet} → закончить на ${fmtTimecode(b.out, 3)}`
+                    : `Перерыв ${quiet} (${fmtSeconds(b.quiet_to - b.quiet_from)}) → конец ${fmtTimecode(b.out, 3)}, продолжение ${fmtTimecode(b.in, 3)}` + (b.scene >= 0.3 ? ' · смена сцены' : '');
+                row.onclick = () => seekPreview(b.head ? b.in : b.quiet_from);
+                row.append(box_, text); box.append(row);
+            });
+            const apply = document.createElement('button'); apply.type = 'button'; apply.textContent = 'Разбить видео по отмеченным перерывам';
+            apply.onclick = () => applySuggestions(previewPath); box.append(apply);
+        }
+        function applySuggestions(path) {
+            const info = analyses[path]; if (!info || info.state !== 'ready') return;
+            const chosen = info.breaks.filter(b => b.checked);
+            const head = chosen.find(b => b.head), tail = chosen.find(b => b.tail);
+            let start = head ? head.in : 0; const ranges = [];
+            chosen.filter(b => !b.head && !b.tail).forEach(b => { ranges.push([start, b.out]); start = b.in; });
+            ranges.push([start, tail ? tail.out : info.duration]);
+            const kept = ranges.filter(([s, e]) => e - s >= info.min_segment);
+            // Сегменты этого видео заменяются новыми на том же месте таймлайна, остальные не трогаются.
+            const owned = segments.map((seg, idx) => segmentVideo(idx) === path);
+            const at = owned.indexOf(true) >= 0 ? owned.indexOf(true) : segments.length;
+            const audio = at < segments.length ? segments[at].audio : '';
+            const created = kept.map(([s, e], i) => ({ video: i === 0 ? path : '', audio: i === 0 ? audio : '', start: fmtTimecode(s, 3), end: fmtTimecode(e, 3) }));
+            const rest = segments.filter((seg, idx) => !owned[idx]);
+            const before = rest.slice(0, segments.slice(0, at).filter((seg, idx) => !owned[idx]).length);
+            segments = [...before, ...created, ...rest.slice(before.length)];
+            if (!segments.length) segments = [{ video: '', audio: '', start: '', end: '' }];
+            renderSegments(); appendLog(`Таймлайн для ${path.split('/').pop()}: ${created.length} сегмент(ов) по подсказкам.`);
+        }
+        function takeTime(idx, field) {
+            const v = document.getElementById('videoPreview');
+            if (!v.dataset.url || previewPath !== segmentVideo(idx)) { appendLog(`Сначала откройте видео сегмента ${idx + 1} в предпросмотре.`); return; }
+            segments[idx][field] = fmtTimecode(v.currentTime); renderSegments();
+        }
+        function jumpToTime(idx,field){showPreview(segmentVideo(idx));const t=hmsToSeconds(segments[idx][field]),v=document.getElementById('videoPreview');if(!v.dataset.url)return;const seek=()=>{v.currentTime=t;v.play()};if(v.readyState>=1)seek();else v.addEventListener('loadedmetadata',seek,{once:true})}
+        function renderSegments() {
+            const box = document.getElementById('segments'); box.innerHTML = '';
+            segments.forEach((seg, idx) => {
+                const el = document.createElement('div'); el.className = 'segment';
+                const inherited = !seg.video && idx > 0 ? segmentVideo(idx) : '';
+                el.innerHTML = `<div class="segment-header"><h4>Сегмент ${idx + 1}</h4>${segments.length > 1 ? '<button type="button" class="remove-btn" title="Удалить сегмент">✕</button>' : ''}</div>
+                    <button type="button" class="video-btn">Видео...</button><div class="file-path-display video-path"></div>
+                    <button type="button" class="audio-btn">Аудио (опция)...</button><div class="file-path-display audio-path"></div>
+                    <div class="time-input-group"><label style="width:60px;">Начало:</label> <input type="text" class="start" placeholder="00:01:10"><button class="jump-btn start-jump">▶</button><button class="take-btn start-take" title="Взять время из предпросмотра">⏱</button></div>
+                    <div class="time-input-group"><label style="width:60px;">Конец:</label> <input type="text" class="end" placeholder="00:45:30"><button class="jump-btn end-jump">▶</button><button class="take-btn end-take" title="Взять время из предпросмотра">⏱</button></div>`;
+                el.querySelector('.video-path').textContent = seg.video || (inherited ? `(как в сегменте выше) ${inherited}` : '');
+                el.querySelector('.audio-path').textContent = seg.audio;
+                el.querySelector('.video-btn').onclick = () => selectFile(`seg:${idx}:video`);
+                el.querySelector('.audio-btn').onclick = () => selectFile(`seg:${idx}:audio`);
+                ['start', 'end'].forEach(field => {
+                    const input = el.querySelector('.' + field); input.value = seg[field];
+                    input.oninput = () => { seg[field] = input.value; };
+                    el.querySelector(`.${field}-jump`).onclick = () => jumpToTime(idx, field);
+                    el.querySelector(`.${field}-take`).onclick = () => takeTime(idx, field);
+                });
+                const remove = el.querySelector('.remove-btn');
+                if (remove) remove.onclick = () => { segments.splice(idx, 1); renderSegments(); };
+                box.append(el);
+            });
+        }
+        function addSegment() { segments.push({ video: '', audio: '', start: '', end: '' }); renderSegments(); }
 
         function connect() {
             ws = new WebSocket(`ws://127.0.0.1:${SERVER_PORT}`);
-            ws.onopen = () => { logOutput.textContent = 'Соединение установлено. Готов к работе.\\n'; };
-            ws.onerror = () => { logOutput.textContent = 'Ошибка соединения WebSocket. Повторная попытка через 2 секунды...\\n'; };
+            ws.onopen = () => { setLog('Соединение установлено. Готов к работе.'); ws.send(JSON.stringify({ action: 'list_jobs' })); };
+            ws.onerror = () => { setLog('Ошибка соединения WebSocket. Повторная попытка через 2 секунды...'); };
             ws.onclose = () => { setTimeout(connect, 2000); };
             ws.onmessage = (event) => {
                 const data = JSON.parse(event.data);
                 if (data.action === 'file_selected') {
-                    if (data.path) {
+                    if (data.path && data.id.startsWith('seg:')) {
+                        const [, idx, field] = data.id.split(':');
+                        if (segments[idx]) { segments[idx][field] = data.path; renderSegments(); if (field === 'video') { showPreview(data.path); requestAnalysis(data.path); } }
+                    } else if (data.path) {
                         filePaths[data.id] = data.path;
                         document.getElementById(data.id + '_path').textContent = data.path;
-                        if (data.id === 'video1') { document.getElementById('videoPreview').src = 'file://' + data.path; }
                     }
                 } else if (data.action === 'log') {
-                    if (data.message.startsWith('frame=')) {
-                        const lines = logOutput.textContent.split('\\n');
-                        if (lines.length > 1 && lines[lines.length - 2].startsWith('frame=')) {
-                            lines[lines.length - 2] = data.message;
-                            logOutput.textContent = lines.join('\\n');
-                        } else {
-                            logOutput.textContent += data.message + '\\n';
-                        }
-                    } else {
-                        logOutput.textContent += data.message + '\\n';
-                    }
-                    logOutput.scrollTop = logOutput.scrollHeight;
-                } else if (data.action === 'finished') { document.getElementById('submitBtn').disabled = false; document.getElementById('submitBtn').textContent = 'Начать Обработку'; }
+                    appendLog((data.job_id ? `#${data.job_id} ` : '') + data.message);
+                } else if (data.action === 'log_batch') {
+                    appendLog(...data.lines.map(l => (data.job_id ? `#${data.job_id} ` : '') + l));
+                } else if (data.action === 'progress') {
+                    updateProgress(data);
+                } else if (data.action === 'preview_status') {
+                    previews[data.path] = data; if (data.path === previewPath) applyPreview(data.path);
+                } else if (data.action === 'analysis_status') {
+                    analyses[data.path] = data; if (data.path === previewPath) renderSuggestions();
+                } else if (data.action === 'metrics') {
+                    renderMetrics(data.report);
+                } else if (data.action === 'job_queued') {
+                    jobs[data.job.id] = data.job; renderJobs();
+                    document.getElementById('submitBtn').disabled = false; document.getElementById('submitBtn').textContent = 'Начать Обработку';
+                    appendLog(`Задание #${data.job.id} поставлено в очередь.`);
+                } else if (data.action === 'jobs') {
+                    jobs = {}; data.jobs.forEach(job => { jobs[job.id] = job; }); renderJobs();
+                } else if (data.action === 'job_update') {
+                    jobs[data.job.id] = data.job; renderJobs();
+                } else if (data.action === 'job_info' && data.job) {
+                    setLog(`--- Журнал задания #${data.job.id} (${JOB_STATUS[data.job.status] || data.job.status}) ---`); appendLog(...data.job.log); renderMetrics(data.job.metrics);
+                } else if (data.action === 'cancel_result' && !data.ok) {
+                    appendLog(`Задание #${data.job_id} уже завершено или не найдено.`);
+                }
             };
         }
         window.onload = connect;
-        function selectFile(id) { if(ws && ws.readyState === WebSocket.OPEN){ ws.send(JSON.stringify({ action: 'select_file', id: id })); } else { logOutput.textContent += '\\nОшибка: нет соединения.\\n'; } }
+        function selectFile(id) { if(ws && ws.readyState === WebSocket.OPEN){ ws.send(JSON.stringify({ action: 'select_file', id: id })); } else { appendLog('Ошибка: нет соединения.'); } }
         
-        // ИЗМЕНЕНИЕ: Упрощенная и корректная логика
-        function toggleMode() {
-            const isSingleFileMode = document.getElementById('singleFile').checked;
-            const isSingleSegmentMode = document.getElementById('is_single_segment').checked;
-            
-            // Показываем/скрываем поля для второго ИСТОЧНИКА (видео и аудио)
-            document.getElementById('video2_container').style.display = isSingleFileMode ? 'none' : 'block';
-            document.getElementById('audio2_container').style.display = isSingleFileMode ? 'none' : 'block';
-            
-            // Чекбокс "единый ролик" имеет смысл только в режиме одного файла
-            document.getElementById('single_segment_toggle_div').style.display = isSingleFileMode ? 'block' : 'none';
-            
-            // Поля для второго СЕГМЕНТА (таймкоды) скрываются только если это один файл И один сегмент
-            const showSecondTimecodes = !isSingleFileMode || (isSingleFileMode && !isSingleSegmentMode);
-            document.getElementById('part2_timecodes').style.display = showSecondTimecodes ? 'block' : 'none';
-        }
-
         function submitForm() {
-            if (!ws || ws.readyState !== WebSocket.OPEN) { logOutput.textContent += '\\nОшибка: нет соединения.\\n'; return; }
-            if (!filePaths.video1) { alert("Пожалуйста, выберите Видео 1"); return; }
-            document.getElementById('submitBtn').disabled = true; document.getElementById('submitBtn').textContent = 'Обработка...'; logOutput.textContent = 'Запускаем...\\n';
+            if (!ws || ws.readyState !== WebSocket.OPEN) { appendLog('Ошибка: нет соединения.'); return; }
+            if (!segments[0].video) { alert("Пожалуйста, выберите видео для сегмента 1"); return; }
+            const emptyIdx = segments.findIndex(seg => !seg.start || !seg.end);
+            if (emptyIdx >= 0) { alert(`Укажите начало и конец сегмента ${emptyIdx + 1}`); return; }
+            document.getElementById('submitBtn').disabled = true; document.getElementById('submitBtn').textContent = 'Отправка...';
             const params = {
                 use_ram: document.getElementById('use_ram').checked,
-                mode: document.querySelector('input[name="mode"]:checked').value,
-                is_single_segment: document.getElementById('is_single_segment').checked,
                 intro_resolution: document.querySelector('input[name="intro_resolution"]:checked').value,
-                start1: document.getElementById('start1').value, end1: document.getElementById('end1').value,
-                start2: document.getElementById('start2').value, end2: document.getElementById('end2').value,
+                audio_codec: document.getElementById('audio_codec').value,
+                segments: segments.map(seg => ({ ...seg })),
                 ...filePaths
             };
             ws.send(JSON.stringify({ action: 'process', params: params }));
         }
-        toggleMode();
+        renderSegments();
     </script>
 </body>
 </html>
@@ -177,181 +376,27 @@ HTML_CONTENT = """
 def open_file_dialog():
     root = Tk(); root.withdraw(); root.attributes("-topmost", True); file_path = filedialog.askopenfilename(); root.destroy(); return file_path
 
-async def send_log(websocket, message):
-    try: await websocket.send(json.dumps({"action": "log", "message": message}))
-    except websockets.exceptions.ConnectionClosed: pass
-
-async def run_async_command(websocket, command, title=""):
-    if title: await send_log(websocket, f"--- {title} ---")
-    
-    process = await asyncio.create_subprocess_exec(
-        *command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.STDOUT
-    )
-    
-    buffer = ""
-    while True:
-        chunk = await process.stdout.read(128)
-        if not chunk:
-            break
-        
-        decoded_chunk = buffer + chunk.decode(errors='ignore')
-        lines = decoded_chunk.replace('\r', '\n').split('\n')
-        
-        buffer = lines.pop()
-        
-        for line in lines:
-            stripped_line = line.strip()
-            if stripped_line:
-                await send_log(websocket, stripped_line)
-
-    if buffer.strip():
-        await send_log(websocket, buffer.strip())
-
-    await process.wait()
-    if process.returncode != 0:
-        raise subprocess.CalledProcessError(process.returncode, " ".join(map(str, command)))
-
-
-async def handle_processing(websocket, params):
-    temp_files_to_clean = []
-    try:
-        tmp_dir = "/dev/shm" if params.get('use_ram') and os.path.exists('/dev/shm') else '.'
-        await send_log(websocket, "--- Этап 1: Подготовка данных ---")
-        
-        intro_resolution = params.get('intro_resolution', '2k')
-        await send_log(websocket, f"Выбрано разрешение интро: {intro_resolution}")
-
-        intro_path = os.path.realpath(os.path.join(DEFAULT_INTRO_DIR, f"{INTRO_BASE_NAME}_{intro_resolution}.mkv"))
-        if not os.path.exists(intro_path):
-            source_intro = params.get('intro_file') or next((os.path.realpath(pth) for pth in [os.path.join(DEFAULT_INTRO_DIR, f"{INTRO_BASE_NAME}.mp4"), os.path.join(DEFAULT_INTRO_DIR, f"{INTRO_BASE_NAME}.mkv")] if os.path.exists(pth)), None)
-            if not source_intro: raise FileNotFoundError("Исходник интро не найден и не был выбран!")
-            scale = "scale=2560:1440" if intro_resolution == '2k' else "scale=1920:1080"
-            await run_async_command(websocket, ['ffmpeg','-hide_banner','-loglevel', 'error', '-i', source_intro, '-vf', scale, '-c:v', VIDEO_ENCODER, '-preset', 'medium', '-c:a', 'copy', intro_path, '-y'], f"Создание интро {intro_resolution}")
-        
-        segments = []
-        is_single_segment = params.get('is_single_segment') and params.get('mode') == 'single'
-        
-        if not params.get('video1'): raise ValueError("Не указан Видеофайл 1.")
-        
-        def hms_to_seconds(time_str):
-            if not time_str: return 0
-            parts = str(time_str).split(':'); s = 0.0
-            try:
-                if len(parts) == 3: s = int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2])
-                elif len(parts) == 2: s = int(parts[0]) * 60 + float(parts[1])
-                elif len(parts) == 1 and time_str: s = float(time_str)
-            except ValueError: s = 0.0
-            return s
-            
-        segments.append({
-            'video_orig': params['video1'], 'audio_orig': params.get('audio1') or params['video1'],
-            'start': hms_to_seconds(params['start1']), 'end': hms_to_seconds(params['end1'])
-        })
-
-        if not is_single_segment:
-            # ИЗМЕНЕНИЕ: В режиме одного файла, audio2 по умолчанию будет равно audio1 (или video1)
-            video2_path = params['video1'] if params['mode'] == 'single' else params.get('video2')
-            if not video2_path: raise ValueError("Не указан Видеофайл 2 для режима двух файлов.")
-            
-            audio2_source = params.get('audio2') or video2_path
-            if params['mode'] == 'single' and not params.get('audio2'):
-                audio2_source = params.get('audio1') or video2_path # Если audio2 не задан в режиме 1 файла, используем audio1
+job_queue = jobs.JobQueue(handle_processing, MAX_CONCURRENT_JOBS)
 
-            segments.append({
-                'video_orig': video2_path, 
-                'audio_orig': audio2_source,
-                'start': hms_to_seconds(params['start2']), 
-                'end': hms_to_seconds(params['end2'])
-            })
-        
-        video_concat_parts = [f"file '{intro_path}'"]
-        audio_filter_definitions = []
-        audio_concat_inputs = "[1:a]"
-        ffmpeg_audio_inputs = ['-i', intro_path]
-
-        for i, seg in enumerate(segments):
-            await send_log(websocket, f"\n--- Обработка сегмента {i+1} ---")
-            
-            seg['video'] = seg['video_orig']
-            if not seg['video'].lower().endswith('.mkv'):
-                base, _ = os.path.splitext(seg['video']); sanitized = f"{base}_sanitized.mkv"
-                if not os.path.exists(sanitized):
-                    await run_async_command(websocket, ['ffmpeg','-hide_banner','-loglevel', 'error','-stats','-i', seg['video'], '-c', 'copy', sanitized, '-y'], f"Переупаковка '{os.path.basename(seg['video'])}'")
-                seg['video'] = sanitized
-            
-            seg['audio'] = seg['audio_orig']
-            if seg['audio_orig'] == seg['video_orig'] and seg['video'] != seg['video_orig']: seg['audio'] = seg['video']
-                 
-            cache_file = f"{seg['video']}.keyframes.txt"
-            if not os.path.exists(cache_file):
-                await send_log(websocket, f"Создание кэша I-кадров для {os.path.basename(seg['video'])}...")
-                process = await asyncio.create_subprocess_exec('ffprobe','-v','error','-select_streams','v:0','-show_entries','packet=pts_time,flags','-of','csv=p=0', seg['video'], stdout=subprocess.PIPE)
-                keyframes_data_bytes, _ = await process.communicate()
-                with open(cache_file, 'w') as f: f.write('\n'.join([l.split(',')[0] for l in keyframes_data_bytes.decode().strip().split('\n') if ',K' in l]))
 
-            with open(cache_file, 'r') as f: keyframes = [float(t) for t in f.read().strip().split('\n') if t]
-            seg['start_split'] = next((t for t in keyframes if t > seg['start'] + FADE_DURATION), None)
-            seg['end_split'] = [t for t in keyframes if t < seg['end'] - FADE_DURATION][-1] if any(t < seg['end'] - FADE_DURATION for t in keyframes) else None
-            if not seg['start_split'] or not seg['end_split']: raise ValueError(f"Не найдены точки разделения для сегмента {i+1}. Сегмент слишком короткий или неверные таймкоды.")
-            await send_log(websocket, f"Точки разделения: {seg['start_split']} -> {seg['end_split']}")
-            
-            seg['fout_rel'] = seg['end'] - seg['end_split'] - FADE_DURATION
-            fade_in_path = os.path.join(tmp_dir, f"part{i+1}_fade_in.mkv"); temp_files_to_clean.append(fade_in_path)
-            fade_out_path = os.path.join(tmp_dir, f"part{i+1}_fade_out.mkv"); temp_files_to_clean.append(fade_out_path)
-            await run_async_command(websocket, ['ffmpeg','-hide_banner','-loglevel', 'error','-stats','-ss', str(seg['start']), '-to', str(seg['start_split']), '-i', seg['video'], '-an', '-vf', f"fade=in:st=0:d={FADE_DURATION},setpts=PTS-STARTPTS", '-c:v', VIDEO_ENCODER, '-preset', 'ultrafast', fade_in_path, '-y'], "Создание fade-in")
-            await run_async_command(websocket, ['ffmpeg','-hide_banner','-loglevel', 'error','-stats','-ss', str(seg['end_split']), '-to', str(seg['end']), '-i', seg['video'], '-an', '-vf', f"fade=out:st={seg['fout_rel']:.4f}:d={FADE_DURATION},setpts=PTS-STARTPTS", '-c:v', VIDEO_ENCODER, '-preset', 'ultrafast', fade_out_path, '-y'], "Создание fade-out")
+class BroadcastChannel:
+    """Канал для фоновых задач вне очереди (прокси предпросмотра): сообщения видят все клиенты."""
+    async def send(self, message):
+        await job_queue.broadcast(json.loads(message))
 
-            video_concat_parts.extend([f"file '{fade_in_path}'", f"file '{seg['video']}'\ninpoint {seg['start_split']}\noutpoint {seg['end_split']}", f"file '{fade_out_path}'"])
-            ain_idx = 1 + 1 + i
-            ffmpeg_audio_inputs.extend(['-i', seg['audio']])
-            audio_filter_definitions.extend([
-                f"[{ain_idx}:a]asplit=3[aud{i}s1][aud{i}s2][aud{i}s3]",
-                f"[aud{i}s1]atrim=start={seg['start']}:end={seg['start_split']},asetpts=PTS-STARTPTS,afade=t=in:st=0:d={FADE_DURATION}[aud{i}fi]",
-                f"[aud{i}s2]atrim=start={seg['start_split']}:end={seg['end_split']},asetpts=PTS-STARTPTS[aud{i}mb]",
-                f"[aud{i}s3]atrim=start={seg['end_split']}:end={seg['end']},asetpts=PTS-STARTPTS,afade=t=out:st={seg['fout_rel']:.4f}:d={FADE_DURATION}[aud{i}fo]"
-            ])
-            audio_concat_inputs += f"[aud{i}fi][aud{i}mb][aud{i}fo]"
-
-        await send_log(websocket, "\n--- Этап 3: Финальная сборка ---")
-        concat_path = os.path.join(tmp_dir, "concat.txt"); temp_files_to_clean.append(concat_path)
-        with open(concat_path, 'w', encoding='utf-8') as f: f.write("\n".join(video_concat_parts))
-
-        num_audio_filter_outputs = 1 + (len(segments) * 3)
-        final_concat_filter = f"{audio_concat_inputs}concat=n={num_audio_filter_outputs}:v=0:a=1[fa]"
-        filter_complex = ";".join(audio_filter_definitions + [final_concat_filter])
-        
-        base_name, _ = os.path.splitext(os.path.basename(segments[0]['video_orig']))
-        
-        res_prefix = params.get('intro_resolution', '2k')
-        
-        output_name = f"{res_prefix}_{base_name.replace('_sanitized','').replace('part1','')}_final_edit.mkv"
-        output_dir = os.path.dirname(params['video1'])
-        output_path = os.path.join(output_dir, output_name)
-
-        final_cmd = ['ffmpeg','-hide_banner','-loglevel','error','-stats','-f','concat','-safe','0','-i', concat_path] + ffmpeg_audio_inputs + ['-filter_complex', filter_complex, '-map','0:v','-map','[fa]', '-c:v','copy','-r','60', '-c:a', FINAL_AUDIO_CODEC, output_path,'-y']
-        
-        await run_async_command(websocket, final_cmd, "Запускаем финальную сборку")
-        await send_log(websocket, f"\nУСПЕХ! Финальный файл сохранен: {output_path}")
-
-    except Exception as e:
-        import traceback
-        await send_log(websocket, f"\n\nКРИТИЧЕСКАЯ ОШИБКА: {str(e)}\n{traceback.format_exc()}\n")
-    finally:
-        await send_log(websocket, "\n--- Очистка ---")
-        for f in temp_files_to_clean:
-            if os.path.exists(f): 
-                try:
-                    os.remove(f)
-                    await send_log(websocket, f"Удалено: {f}")
-                except OSError as e:
-                    await send_log(websocket, f"Не удалось удалить {f}: {e}")
-        await websocket.send(json.dumps({"action": "finished"}))
 
+preview_channel = BroadcastChannel()
+analyses = analysis.AnalysisManager(
+    lambda status: job_queue.broadcast({"action": "analysis_status", **status}),
+    lambda tag, event: job_queue.broadcast({"action": "progress", "tag": tag, **event}),
+    FADE_DURATION)
+previews = preview.PreviewManager(
+    lambda cmd, title, tag, duration: run_async_command(preview_channel, cmd, title, tag, duration),
+    lambda status: job_queue.broadcast({"action": "preview_status", **status}))
 
 async def handler(websocket):
     print("Клиент WebSocket подключен.")
+    job_queue.clients.add(websocket)
     try:
         async for message in websocket:
             data = json.loads(message)
@@ -360,9 +405,25 @@ async def handler(websocket):
                 file_path = await asyncio.to_thread(open_file_dialog)
                 await websocket.send(json.dumps({ "action": "file_selected", "id": data.get("id"), "path": file_path }))
             elif action == "process":
-                asyncio.create_task(handle_processing(websocket, data.get("params", {})))
+                job = job_queue.submit(data.get("params", {}))
+                await websocket.send(json.dumps({"action": "job_queued", "job": job.to_dict()}))
+                await job_queue.notify(job)
+            elif action == "preview":
+                await websocket.send(json.dumps({"action": "preview_status", **previews.request(data.get("path"))}))
+            elif action == "analyze":
+                await websocket.send(json.dumps({"action": "analysis_status", **await analyses.request(data.get("path"))}))
+            elif action == "list_jobs":
+                await websocket.send(json.dumps({"action": "jobs", "jobs": job_queue.list()}))
+            elif action == "job_info":
+                job = job_queue.jobs.get(data.get("job_id"))
+                await websocket.send(json.dumps({"action": "job_info", "job": job.to_dict(with_log=True) if job else None}))
+            elif action == "cancel_job":
+                cancelled = await job_queue.cancel(data.get("job_id"))
+                await websocket.send(json.dumps({"action": "cancel_result", "job_id": data.get("job_id"), "ok": cancelled}))
     except websockets.exceptions.ConnectionClosed:
         print("Клиент отключился.")
+    finally:
+        job_queue.clients.discard(websocket)
 
 async def main():
     try: 
@@ -371,9 +432,14 @@ async def main():
         print("\nКРИТИЧЕСКАЯ ОШИБКА: 'tkinter' не найден. Установите его (обычно 'sudo apt-get install python3-tk' или 'pacman -S tk').")
         exit(1)
     
+    # Временные папки заданий, оставшиеся после аварийного завершения прошлого запуска.
+    for path in tempstore.sweep_stale(): print(f"Удалена брошенная временная папка: {path}")
+
     async def http_server_handler(path, request_headers):
         if "Upgrade" in request_headers and request_headers["Upgrade"].lower() == "websocket":
             return None
+        if path.startswith("/preview/"):
+            return await asyncio.to_thread(previews.respond, path, request_headers.get("Range"))
         print(f"Отдаю HTML страницу для пути: {path}")
         headers = {"Content-Type": "text/html; charset=utf-8"}
         return (http.HTTPStatus.OK, headers, HTML_CONTENT.encode())
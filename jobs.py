@@ -0,0 +1,131 @@
+import asyncio
+import collections
+import json
+import time
+import uuid
+
+# ==============================================================================
+# ---                       ОЧЕРЕДЬ И ПЛАНИРОВЩИК ЗАДАНИЙ                      ---
+# ==============================================================================
+# Задания живут на сервере, а не в конкретной вкладке браузера: сообщения
+# рассылаются всем подключённым клиентам, поэтому после перезагрузки страницы
+# очередь и журналы заданий остаются доступны.
+MAX_CONCURRENT_JOBS = 1
+JOB_LOG_TAIL = 200     # Сколько последних строк журнала хранить у задания
+JOB_HISTORY = 100      # Сколько завершённых заданий помнить
+
+ACTIVE_STATES = ('queued', 'running')
+
+
+class Job:
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex[:8]
+        self.params = params
+        self.status = 'queued'
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.log_tail = collections.deque(maxlen=JOB_LOG_TAIL)
+        self.metrics = None
+        self.task = None
+
+    def to_dict(self, with_log=False):
+        data = {
+            'id': self.id, 'status': self.status, 'error': self.error,
+            'created': self.created, 'started': self.started, 'finished': self.finished,
+            'video1': self.params.get('video1') or next((seg.get('video') for seg in self.params.get('segments') or [] if seg.get('video')), ''),
+            'segments': len(self.params.get('segments') or []) or None,
+        }
+        if with_log: data['log'], data['metrics'] = list(self.log_tail), self.metrics
+        return data
+
+
+class JobChannel:
+    """Канал сообщений одного задания: помечает их id задания и рассылает всем клиентам."""
+    def __init__(self, queue, job):
+        self._queue = queue
+        self._job = job
+
+    async def send(self, message):
+        data = json.loads(message)
+        data['job_id'] = self._job.id
+        if data.get('action') == 'log': self._job.log_tail.append(data['message'])
+        elif data.get('action') == 'log_batch': self._job.log_tail.extend(data['lines'])
+        elif data.get('action') == 'metrics': self._job.metrics = data['report']
+        await self._queue.broadcast(data)
+
+
+class JobQueue:
+    """FIFO-очередь с ограничением числа одновременно выполняемых заданий.
+
+    `runner(channel, params, job_id)` — корутина, выполняющая одно задание.
+    """
+    def __init__(self, runner, max_concurrent=MAX_CONCURRENT_JOBS):
+        self._runner = runner
+        self._pending = collections.deque()
+        self._running = 0
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.jobs = {}
+        self.clients = set()
+
+    def submit(self, params):
+        job = Job(params)
+        self.jobs[job.id] = job
+        self._pending.append(job)
+        self._prune_history()
+        self._schedule()
+        return job
+
+    async def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in ACTIVE_STATES: return False
+        if job.status == 'queued':
+            self._pending.remove(job)
+            job.status, job.finished = 'cancelled', time.time()
+            await self.notify(job)
+        else:
+            # Отмена задачи доходит до run_async_command, который убивает дочерний ffmpeg.
+            job.task.cancel()
+        return True
+
+    def list(self):
+        return [job.to_dict() for job in self.jobs.values()]
+
+    async def broadcast(self, data):
+        if not self.clients: return
+        message = json.dumps(data)
+        clients = list(self.clients)
+        results = await asyncio.gather(*(client.send(message) for client in clients), return_exceptions=True)
+        for client, result in zip(clients, results):
+            if isinstance(result, Exception): self.clients.discard(client)
+
+    async def notify(self, job):
+        await self.broadcast({'action': 'job_update', 'job': job.to_dict()})
+
+    def _schedule(self):
+        while self._running < self.max_concurrent and self._pending:
+            job = self._pending.popleft()
+            self._running += 1
+            job.task = asyncio.create_task(self._run(job))
+
+    async def _run(self, job):
+        job.status, job.started = 'running', time.time()
+        try:
+            await self.notify(job)
+            await self._runner(JobChannel(self, job), job.params, job.id)
+            job.status = 'done'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status, job.error = 'failed', str(e)
+        finally:
+            job.finished = time.time()
+            self._running -= 1
+            self._schedule()
+        await self.notify(job)
+
+    def _prune_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status not in ACTIVE_STATES]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self.jobs[job_id]
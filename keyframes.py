@@ -0,0 +1,218 @@
+import asyncio
+import bisect
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# ==============================================================================
+# ---                     БИНАРНЫЙ ИНДЕКС КЛЮЧЕВЫХ КАДРОВ                      ---
+# ==============================================================================
+# Формат файла "<видео>.keyframes.idx":
+#   заголовок (48 байт, little-endian):
+#     magic[8] | версия u32 | резерв u32 | число кадров u64 |
+#     размер источника u64 | mtime источника (нс) i64 | длительность f64
+#   далее — плотный отсортированный массив float64 с pts_time ключевых кадров.
+# Заголовок хранит "отпечаток" источника: если файл изменился, кэш пересобирается.
+INDEX_SUFFIX = ".keyframes.idx"
+INDEX_VERSION = 1
+_MAGIC = b"KFINDEX\x00"
+_HEADER = struct.Struct("<8sIIQQqd")
+_ITEM_SIZE = 8
+# Способ построения индекса:
+#   "packets" — обход пакетов с флагом K контейнера (без декодирования); именно
+#               на эти кадры опирается inpoint concat-демультиплексора;
+#   "frames"  — декодирование только ключевых кадров (-skip_frame nokey). Декодер
+#               может считать ключевыми другие кадры, поэтому это только опция
+#               для сравнения в bench.py (--index-method frames).
+INDEX_METHOD = "packets"
+
+
+def index_path_for(source):
+    return f"{source}{INDEX_SUFFIX}"
+
+
+def _source_fingerprint(source):
+    st = os.stat(source)
+    return st.st_size, st.st_mtime_ns
+
+
+class KeyframeIndex:
+    def __init__(self, times, duration, source_size, source_mtime_ns, mm=None):
+        self._times = times
+        self._mm = mm
+        self.duration = duration
+        self.source_size = source_size
+        self.source_mtime_ns = source_mtime_ns
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size: raise ValueError(f"Повреждённый индекс: {path}")
+            magic, version, _, count, size, mtime_ns, duration = _HEADER.unpack(header)
+            if magic != _MAGIC or version != INDEX_VERSION: raise ValueError(f"Неизвестный формат индекса: {path}")
+            expected = _HEADER.size + count * _ITEM_SIZE
+            if os.fstat(f.fileno()).st_size != expected: raise ValueError(f"Повреждённый индекс: {path}")
+            if count == 0:
+                return cls(array('d'), duration, size, mtime_ns)
+            if sys.byteorder != 'little':
+                times = array('d'); times.frombytes(f.read(count * _ITEM_SIZE)); times.byteswap()
+                return cls(times, duration, size, mtime_ns)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        times = memoryview(mm)[_HEADER.size:expected].cast('d')
+        return cls(times, duration, size, mtime_ns, mm)
+
+    @staticmethod
+    def write(path, times, duration, source_size, source_mtime_ns):
+        data = array('d', times)
+        if sys.byteorder != 'little': data.byteswap()
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, INDEX_VERSION, 0, len(times), source_size, source_mtime_ns, duration))
+            f.write(data.tobytes())
+        os.replace(tmp_path, path)
+
+    def is_fresh_for(self, source):
+        try: return _source_fingerprint(source) == (self.source_size, self.source_mtime_ns)
+        except OSError: return False
+
+    def close(self):
+        if self._mm is not None:
+            self._times.release()
+            self._mm.close()
+            self._mm = None
+        self._times = array('d')
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+    def __len__(self): return len(self._times)
+    def __getitem__(self, i): return self._times[i]
+    def __iter__(self): return iter(self._times)
+
+    # --- Поиск за O(log n) ---
+    def first_after(self, t):
+        """Первый ключевой кадр строго после t (или None)."""
+        i = bisect.bisect_right(self._times, t)
+        return self._times[i] if i < len(self._times) else None
+
+    def last_before(self, t):
+        """Последний ключевой кадр строго до t (или None)."""
+        i = bisect.bisect_left(self._times, t)
+        return self._times[i - 1] if i > 0 else None
+
+    def nearest(self, t):
+        i = bisect.bisect_left(self._times, t)
+        candidates = [self._times[j] for j in (i - 1, i) if 0 <= j < len(self._times)]
+        return min(candidates, key=lambda k: abs(k - t)) if candidates else None
+
+
+# ==============================================================================
+# ---                        ПОСТРОЕНИЕ ИНДЕКСА (FFPROBE)                      ---
+# ==============================================================================
+async def probe_duration(source):
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', source,
+        stdout=asyncio.subprocess.PIPE)
+    out, _ = await process.communicate()
+    try: return float(out.decode().strip())
+    except ValueError: return 0.0
+
+
+async def probe_bit_rate(source):
+    """Общий битрейт контейнера, бит/с; None, если ffprobe его не знает."""
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error', '-show_entries', 'format=bit_rate', '-of', 'csv=p=0', source,
+        stdout=asyncio.subprocess.PIPE)
+    out, _ = await process.communicate()
+    try: return int(out.decode().strip())
+    except ValueError: return None
+
+
+async def _probe_keyframes(source, method):
+    keyframes_only = method == "frames"
+    if keyframes_only:
+        # Декодер пропускает все кадры, кроме ключевых: ffprobe выдаёт только их.
+        command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+                   '-show_entries', 'frame=pts_time', '-of', 'csv=p=0', source]
+    else:
+        command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                   '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', source]
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+    times = []
+    try:
+        # Читаем поток построчно, не накапливая весь вывод ffprobe в памяти.
+        async for raw in process.stdout:
+            fields = raw.decode(errors='ignore').strip().split(',')
+            if not keyframes_only and (len(fields) < 2 or 'K' not in fields[1]): continue
+            try: times.append(float(fields[0]))
+            except ValueError: continue
+        await process.wait()
+    except BaseException:
+        if process.returncode is None: process.kill()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"ffprobe завершился с кодом {process.returncode} для {source}")
+    times.sort()
+    return [t for i, t in enumerate(times) if i == 0 or t != times[i - 1]]
+
+
+async def build_index(source, path=None, method=None):
+    path = path or index_path_for(source)
+    method = method or INDEX_METHOD
+    size, mtime_ns = _source_fingerprint(source)
+    times = await _probe_keyframes(source, method)
+    if method == "frames" and not times:
+        # Некоторые декодеры не поддерживают skip_frame — откатываемся на обход пакетов.
+        times = await _probe_keyframes(source, "packets")
+    duration = await probe_duration(source)
+    KeyframeIndex.write(path, times, duration, size, mtime_ns)
+    return KeyframeIndex.load(path)
+
+
+def cached_index(source):
+    """Готовый актуальный индекс источника или None; ничего не пересобирает."""
+    try:
+        index = KeyframeIndex.load(index_path_for(source))
+    except (OSError, ValueError):
+        return None
+    if index.is_fresh_for(source): return index
+    index.close()
+    return None
+
+
+_builds = {}  # путь индекса -> задача сборки, которую ждут все одновременные вызовы
+
+
+async def _build_shared(source, path):
+    (await build_index(source, path)).close()
+
+
+async def open_index(source, log=None):
+    """Открывает индекс источника, пересобирая его при отсутствии или устаревании.
+
+    Предпросмотр, анализ и задания часто открывают один исходник одновременно:
+    сборка индекса на источник идёт одна, остальные вызовы ждут её.
+    """
+    path = index_path_for(source)
+    build = _builds.get(path)
+    if build is None:
+        message = f"Создание кэша I-кадров для {os.path.basename(source)}..."
+        if os.path.exists(path):
+            try:
+                index = KeyframeIndex.load(path)
+                if index.is_fresh_for(source): return index
+                index.close()
+                message = f"Кэш I-кадров устарел для {os.path.basename(source)}, пересоздаём..."
+            except ValueError as e:
+                message = f"{e}. Пересоздаём..."
+        # Задача регистрируется до первого await, чтобы второй вызов её увидел.
+        build = _builds[path] = asyncio.ensure_future(_build_shared(source, path))
+        build.add_done_callback(lambda task: _builds.pop(path, None) if _builds.get(path) is task else None)
+    else:
+        message = f"Кэш I-кадров для {os.path.basename(source)} уже строится, ждём..."
+    if log: await log(message)
+    # Отмена одного вызова не прерывает сборку, которую ждут другие.
+    await asyncio.shield(build)
+    return KeyframeIndex.load(path)
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import time
+
+import render_cache
+
+# ==============================================================================
+# ---                  МАНИФЕСТ ПЛАНА ДЛЯ ИНКРЕМЕНТАЛЬНОЙ ПЕРЕСБОРКИ            ---
+# ==============================================================================
+# После успешной сборки рядом с результатом сохраняется план задания: точки
+# разделения, ключи клипов переходов и краёв звука, диапазоны основной части
+# звука, список concat и звуковой граф. При повторном запуске новый план
+# сравнивается с сохранённым: неизменившиеся клипы берутся из кэша рендеров, а
+# если не изменилось ничего и итоговый файл на месте — финальная сборка
+# пропускается целиком. Основная часть звука не кэшируется: финальная сборка
+# всё равно читает весь таймлайн, и через -ss она дешевле промежуточного файла.
+MANIFEST_VERSION = 2
+
+
+def manifest_path_for(output_path):
+    directory, name = os.path.split(output_path)
+    return os.path.join(directory, f".{name}.plan.json")
+
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+        return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    except FileNotFoundError:
+        return None
+
+
+def segment_fingerprint(seg, clip_keys):
+    """Всё, от чего зависит вклад сегмента в результат."""
+    return {
+        'video': render_cache.source_identity(seg['video']),
+        'audio': render_cache.source_identity(seg['audio']),
+        'start': seg['start'], 'end': seg['end'],
+        'start_split': seg['start_split'], 'end_split': seg['end_split'],
+        'remux': seg['remux'], 'clips': clip_keys,
+        # Основная часть звука: начало, длина в сэмплах и частота дискретизации.
+        'audio_body': [seg['start_split'], seg['audio_samples'][1], seg['sample_rate']],
+    }
+
+
+def build_plan(segments, clip_keys, intro_path, final_args):
+    plan = {
+        'version': MANIFEST_VERSION,
+        'intro': intro_path,
+        'segments': [segment_fingerprint(seg, keys) for seg, keys in zip(segments, clip_keys)],
+        'final_args': final_args,
+    }
+    plan['key'] = hashlib.sha256(json.dumps(plan, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return plan
+
+
+def load(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return data if data.get('plan', {}).get('version') == MANIFEST_VERSION else None
+
+
+def save(path, plan, output_path, concat_list, filter_complex, stages):
+    data = {
+        'plan': plan, 'concat_list': concat_list, 'filter_complex': filter_complex,
+        'output': {'path': output_path, **(_file_state(output_path) or {})},
+        'stages': stages, 'saved': time.time(),
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def diff(previous, plan):
+    """Сравнивает план с сохранённым: номера изменившихся сегментов и прочие отличия."""
+    if previous is None: return {'first_run': True}
+    old = previous['plan']
+    old_segments, new_segments = old['segments'], plan['segments']
+    changed = [i for i, seg in enumerate(new_segments) if i >= len(old_segments) or old_segments[i] != seg]
+    return {
+        'first_run': False,
+        'identical': old['key'] == plan['key'],
+        'changed_segments': changed,
+        'removed_segments': max(0, len(old_segments) - len(new_segments)),
+        'intro_changed': old['intro'] != plan['intro'],
+        'final_args_changed': old['final_args'] != plan['final_args'],
+    }
+
+
+def output_unchanged(previous, output_path):
+    """Итоговый файл существует и не трогался с момента сохранения манифеста."""
+    if previous is None: return False
+    saved = previous.get('output', {})
+    state = _file_state(output_path)
+    return state is not None and saved.get('path') == output_path and \
+        (saved.get('size'), saved.get('mtime_ns')) == (state['size'], state['mtime_ns'])
@@ -0,0 +1,144 @@
+import contextvars
+import json
+import os
+import sys
+import time
+
+import tempstore
+
+# ==============================================================================
+# ---                    ЗАМЕРЫ ЭТАПОВ И КОМАНД ЗАДАНИЯ                        ---
+# ==============================================================================
+# Задание делится на этапы (подготовка, сегменты, переходы, звук, сборка), а
+# каждый запуск ffmpeg записывается отдельно: время начала и конца, CPU и пиковый
+# RSS из rusage завершённого процесса (os.wait4), прочитанные и записанные байты
+# (/proc/<pid>/io) и скорость, которую сообщает сам ffmpeg.
+# По завершении отчёт уходит в интерфейс, дописывается строкой в METRICS_FILE
+# (JSONL) и, если задан каталог, сохраняется в формате Chrome trace
+# (открывается в chrome://tracing или ui.perfetto.dev).
+METRICS_FILE = os.environ.get("VIDEO_EDITOR_METRICS_FILE", os.path.expanduser("~/.cache/ffmpeg_video_editor/metrics.jsonl"))
+TRACE_DIR = os.environ.get("VIDEO_EDITOR_TRACE_DIR")  # None — Chrome trace не пишется
+
+# Замеры текущего задания; задачи asyncio наследуют его, поэтому параллельные
+# переходы попадают в отчёт своего задания без передачи объекта через все вызовы.
+current = contextvars.ContextVar('job_metrics', default=None)
+
+
+def read_proc_io(pid):
+    """Счётчики rchar/wchar процесса (только Linux); None, если недоступны."""
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def maxrss_kb(usage):
+    # ru_maxrss: в Linux — килобайты, в macOS — байты.
+    return usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+
+
+def command_record(tag, title, start, end, returncode, usage, io_counters, speed, media_duration):
+    return {
+        'tag': tag, 'title': title, 'start': start, 'end': end, 'returncode': returncode,
+        'cpu_user_s': usage.ru_utime if usage else None, 'cpu_sys_s': usage.ru_stime if usage else None,
+        'max_rss_kb': maxrss_kb(usage) if usage else None,
+        'read_bytes': io_counters[0] if io_counters else None, 'write_bytes': io_counters[1] if io_counters else None,
+        'speed': speed, 'media_duration': media_duration,
+    }
+
+
+class JobMetrics:
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.stages = []
+        self.commands = []
+        self._stage = None
+        self.temp = None  # отчёт tempstore: пик занятого места в RAM и на диске
+
+    def now(self):
+        return time.perf_counter() - self._t0
+
+    def mark(self, name):
+        """Закрывает текущий этап и открывает следующий."""
+        self.close_stage()
+        self._stage = {'name': name, 'start': self.now(), 'end': None}
+        self.stages.append(self._stage)
+
+    def close_stage(self):
+        if self._stage is not None and self._stage['end'] is None: self._stage['end'] = self.now()
+        self._stage = None
+
+    def add_command(self, record):
+        record['stage'] = self._stage['name'] if self._stage else None
+        self.commands.append(record)
+
+    def report(self, status):
+        self.close_stage()
+        stages = []
+        for stage in self.stages:
+            commands = [c for c in self.commands if c['stage'] == stage['name']]
+            stages.append({
+                **stage, 'wall_s': stage['end'] - stage['start'], 'commands': len(commands),
+                'cpu_s': sum(c['cpu_user_s'] + c['cpu_sys_s'] for c in commands if c['cpu_user_s'] is not None),
+                'max_rss_kb': max((c['max_rss_kb'] or 0 for c in commands), default=0),
+                'read_bytes': sum(c['read_bytes'] or 0 for c in commands),
+                'write_bytes': sum(c['write_bytes'] or 0 for c in commands),
+            })
+        return {'job_id': self.job_id, 'started': self.started, 'wall_s': self.now(), 'status': status,
+                'stages': stages, 'commands': self.commands, 'temp': self.temp}
+
+
+STAGE_TITLES = {
+    'prepare': 'Подготовка', 'segments': 'Сегменты', 'transitions': 'Переходы',
+    'final': 'Финальная сборка', 'cleanup': 'Очистка',
+}
+
+
+def format_report(report):
+    lines = [f"Замеры по этапам (всего {report['wall_s']:.1f} с):"]
+    for s in report['stages']:
+        lines.append(f"  {STAGE_TITLES.get(s['name'], s['name'])}: {s['wall_s']:.1f} с, ffmpeg: {s['commands']}, CPU {s['cpu_s']:.1f} с, "
+                     f"пик RSS {s['max_rss_kb'] / 1024:.0f} МБ, чтение {s['read_bytes'] / 1024**2:.0f} МБ, запись {s['write_bytes'] / 1024**2:.0f} МБ")
+    slowest = max(report['commands'], key=lambda c: c['end'] - c['start'], default=None)
+    if slowest:
+        speed = f", скорость {slowest['speed']}x" if slowest['speed'] else ""
+        lines.append(f"  Самая долгая команда: {slowest['tag'] or slowest['title']} — {slowest['end'] - slowest['start']:.1f} с{speed}")
+    return "\n".join(lines)
+
+
+def append_jsonl(path, report):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+
+def chrome_trace(report):
+    """События "X" формата Chrome trace: этапы на дорожке 0, команды — на свободных дорожках 1..N."""
+    events = [{'name': s['name'], 'cat': 'stage', 'ph': 'X', 'pid': 1, 'tid': 0,
+               'ts': s['start'] * 1e6, 'dur': s['wall_s'] * 1e6,
+               'args': {k: s[k] for k in ('cpu_s', 'max_rss_kb', 'read_bytes', 'write_bytes', 'commands')}}
+              for s in report['stages']]
+    lanes = []  # время освобождения каждой дорожки
+    for c in sorted(report['commands'], key=lambda c: c['start']):
+        lane = next((i for i, free_at in enumerate(lanes) if free_at <= c['start']), len(lanes))
+        if lane == len(lanes): lanes.append(0)
+        lanes[lane] = c['end']
+        events.append({'name': c['tag'] or c['title'] or 'ffmpeg', 'cat': c['stage'] or 'command', 'ph': 'X', 'pid': 1, 'tid': lane + 1,
+                       'ts': c['start'] * 1e6, 'dur': (c['end'] - c['start']) * 1e6,
+                       'args': {k: v for k, v in c.items() if k not in ('start', 'end')}})
+    events += [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': 'этапы' if tid == 0 else f"ffmpeg {tid}"}}
+               for tid in range(len(lanes) + 1)]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'job_id': report['job_id'], 'started': report['started']}}
+
+
+def write_chrome_trace(trace_dir, report):
+    os.makedirs(trace_dir, exist_ok=True)
+    name = tempstore.safe_name(report['job_id']) if report['job_id'] else time.strftime('%Y%m%d-%H%M%S', time.localtime(report['started']))
+    path = os.path.join(trace_dir, f"{name}.trace.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(chrome_trace(report), f, ensure_ascii=False)
+    return path
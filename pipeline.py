@@ -0,0 +1,409 @@
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import threading
+
+import audio
+import keyframes
+import manifest
+import metrics
+import progress
+import render_cache
+import tempstore
+import timeline
+import transitions
+
+# ==============================================================================
+# ---                        НАСТРОЙКИ КОНВЕЙЕРА                              ---
+# ==============================================================================
+# Конвейер не зависит ни от tkinter, ни от websockets: сообщения уходят в любой
+# объект с корутиной send(str) — канал задания GUI или консоль пакетного режима.
+FADE_DURATION = 1.0
+DEFAULT_INTRO_DIR = os.path.realpath("..")
+INTRO_BASE_NAME = "intro_new_sponsored"
+VIDEO_ENCODER = "libx264"
+FINAL_AUDIO_CODEC = "pcm_s16le"  # Варианты и их параметры — audio.AUDIO_CODEC_OPTIONS
+TRANSITION_WORKERS = transitions.DEFAULT_WORKERS  # Сколько переходов рендерить одновременно
+RENDER_CACHE_DIR = render_cache.RENDER_CACHE_DIR    # Кэш интро и переходов (None — отключить)
+RENDER_CACHE_MAX_BYTES = render_cache.RENDER_CACHE_MAX_BYTES
+# Как поступать с исходниками не в MKV:
+#   "auto"  — контейнеры из DIRECT_CONTAINERS читаются напрямую, остальные переупаковываются
+#             только в пределах сохраняемого диапазона, потоком прямо в финальную сборку;
+#   "range" — потоковая переупаковка диапазона для любого контейнера, кроме MKV;
+#   "full"  — старое поведение: полная копия "<имя>_sanitized.mkv" рядом с исходником.
+SOURCE_REMUX = "auto"
+DIRECT_CONTAINERS = ('.mkv', '.mp4', '.mov', '.m4v')
+METRICS_FILE = metrics.METRICS_FILE  # JSONL с отчётами заданий (None — не писать)
+TRACE_DIR = metrics.TRACE_DIR        # Каталог для Chrome trace заданий (None — не писать)
+
+# ==============================================================================
+# ---                        ЛОГИКА ОБРАБОТКИ                                 ---
+# ==============================================================================
+async def send_log(websocket, message):
+    await websocket.send(json.dumps({"action": "log", "message": message}))
+
+async def send_log_batch(websocket, lines):
+    await websocket.send(json.dumps({"action": "log_batch", "lines": lines}))
+
+async def send_progress(websocket, tag, event):
+    await websocket.send(json.dumps({"action": "progress", "tag": tag, **event}))
+
+async def _pipe_reader(pipe):
+    reader = asyncio.StreamReader()
+    transport, _ = await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader, transport
+
+
+def _reap(process):
+    """Дожидается завершения процесса; возвращает его rusage (None, если os.wait4 нет)."""
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return usage
+    process.wait()
+    return None
+
+
+def _start_reaper(process):
+    """Ждёт процесс в отдельном потоке и возвращает future с его rusage.
+
+    Не asyncio.to_thread: каждый ffmpeg держал бы поток общего пула на всё время
+    работы, и при параллельных рендерах кэш, замер временных файлов и HTTP
+    предпросмотра ждали бы свободного потока.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(method, value):
+        if not future.done(): method(value)
+
+    def target():
+        try: usage = _reap(process)
+        except BaseException as e: outcome = (future.set_exception, e)
+        else: outcome = (future.set_result, usage)
+        try: loop.call_soon_threadsafe(settle, *outcome)
+        except RuntimeError: pass  # цикл событий уже закрыт
+    threading.Thread(target=target, name=f"reap-{process.pid}", daemon=True).start()
+    return future
+
+
+def _kill(process):
+    # Не process.kill(): Popen сам вызвал бы waitpid и отнял бы у нас rusage.
+    try:
+        if hasattr(os, 'wait4'): os.kill(process.pid, signal.SIGKILL)
+        else: process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def run_async_command(websocket, command, title="", tag="", duration=None):
+    prefix = f"[{tag}] " if tag else ""
+    if title: await send_log(websocket, f"{prefix}--- {title} ---")
+    
+    # stdout — машиночитаемый прогресс (-progress pipe:1), stderr — сообщения ffmpeg.
+    # Процесс дожидаемся сами через os.wait4, чтобы получить его CPU и пиковый RSS.
+    job_metrics = metrics.current.get()
+    started = job_metrics.now() if job_metrics else None
+    process = subprocess.Popen(progress.with_progress_output(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    reaper = _start_reaper(process)
+    batcher = progress.LogBatcher(lambda lines: send_log_batch(websocket, lines))
+    tracker = progress.ProgressTracker(duration, lambda event: send_progress(websocket, tag or title, event))
+    transports = []
+    io_counters = None
+
+    async def read_log(reader):
+        async for raw in reader:
+            line = raw.decode(errors='ignore').strip()
+            if line: await batcher.add(prefix + line)
+
+    async def read_progress(reader):
+        nonlocal io_counters
+        async for raw in reader:
+            line = raw.decode(errors='ignore')
+            await tracker.feed(line)
+            if line.startswith('progress='):
+                # Счётчики ввода-вывода читаются, пока процесс жив: после wait4 /proc/<pid> исчезает.
+                io_counters = metrics.read_proc_io(process.pid) or io_counters
+                # Конец блока прогресса: строки журнала, ждущие дольше интервала, уходят до следующего события.
+                await batcher.tick()
+
+    try:
+        (stdout, t_out), (stderr, t_err) = await _pipe_reader(process.stdout), await _pipe_reader(process.stderr)
+        transports += [t_out, t_err]
+        await asyncio.gather(read_log(stderr), read_progress(stdout))
+        await batcher.flush()
+        usage = await asyncio.shield(reaper)
+    except BaseException:
+        # При отмене (или любой ошибке) не оставляем "осиротевший" ffmpeg.
+        if not reaper.done(): _kill(process)
+        await asyncio.gather(reaper, return_exceptions=True)
+        raise
+    finally:
+        for transport in transports: transport.close()
+        for pipe in (process.stdout, process.stderr): pipe.close()
+    if job_metrics:
+        job_metrics.add_command(metrics.command_record(tag, title, started, job_metrics.now(), process.returncode, usage, io_counters,
+                                                       tracker.last_event['speed'] if tracker.last_event else None, duration))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, " ".join(map(str, command)))
+
+
+_intro_lock = asyncio.Lock()
+
+def open_render_cache(params):
+    if not RENDER_CACHE_DIR or params.get('use_cache') is False: return None
+    return render_cache.RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES)
+
+
+async def prepare_intro(websocket, params, cache=None, pins=None):
+    intro_resolution = params.get('intro_resolution', '2k')
+    prepared_intro = os.path.realpath(os.path.join(DEFAULT_INTRO_DIR, f"{INTRO_BASE_NAME}_{intro_resolution}.mkv"))
+    source_intro = params.get('intro_file') or next((os.path.realpath(pth) for pth in [os.path.join(DEFAULT_INTRO_DIR, f"{INTRO_BASE_NAME}.mp4"), os.path.join(DEFAULT_INTRO_DIR, f"{INTRO_BASE_NAME}.mkv")] if os.path.exists(pth)), None)
+    if not source_intro:
+        # Исходника нет — используем заранее подготовленное интро, если оно лежит рядом.
+        if os.path.exists(prepared_intro): return prepared_intro
+        raise FileNotFoundError("Исходник интро не найден и не был выбран!")
+    async with _intro_lock:
+        if cache is None and os.path.exists(prepared_intro): return prepared_intro
+        scale = "scale=2560:1440" if intro_resolution == '2k' else "scale=1920:1080"
+        output_path = f"{prepared_intro}.tmp{os.getpid()}.mkv" if cache else prepared_intro
+        command = ['ffmpeg','-hide_banner','-loglevel', 'error', '-i', source_intro, '-vf', scale, '-c:v', VIDEO_ENCODER, '-preset', 'medium', '-c:a', 'copy', output_path, '-y']
+        if cache:
+            # Ключ зависит от содержимого исходника: изменённое интро будет перерендерено.
+            key = render_cache.command_key(command, [source_intro], output_path)
+            hit = cache.lookup(key, pins=pins)
+            if hit: return hit
+        try:
+            await run_async_command(websocket, command, f"Создание интро {intro_resolution}", duration=await keyframes.probe_duration(source_intro))
+        except BaseException:
+            if cache and os.path.exists(output_path): os.remove(output_path)
+            raise
+        return await asyncio.to_thread(cache.store, key, output_path, pins) if cache else output_path
+
+
+def source_remux_mode(path, mode):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.mkv': return 'direct'
+    if mode == 'full': return 'full'
+    if mode == 'auto' and ext in DIRECT_CONTAINERS: return 'direct'
+    return 'range'
+
+
+def plan_range_remux(seg, i, place):
+    """Готовит переупаковку основной части сегмента в MKV.
+
+    Где есть именованные каналы, основная часть пишется в FIFO и читается
+    concat-демультиплексором по мере сборки; иначе — во временный файл задания
+    (только сохраняемый диапазон, а не весь исходник).
+    """
+    streamed = hasattr(os, 'mkfifo')
+    if streamed:
+        body_path = place(f"part{i+1}_body.pipe.mkv", 0)
+        if os.path.exists(body_path): os.remove(body_path)
+        os.mkfifo(body_path)
+    else:
+        body_path = place(f"part{i+1}_body.mkv", tempstore.estimate_bytes('copy', seg['end_split'] - seg['start_split'], seg))
+    command = ['ffmpeg','-hide_banner','-loglevel','error','-stats','-ss', str(seg['start_split']), '-to', str(seg['end_split']), '-i', seg['video'], '-map','0:v:0','-c','copy','-f','matroska', body_path, '-y']
+    return body_path, {'command': command, 'streamed': streamed, 'tag': f"part{i+1} body",
+                       'title': f"Переупаковка основной части сегмента {i+1}", 'duration': seg['end_split'] - seg['start_split']}
+
+
+async def run_with_producers(websocket, producers, command, title, duration):
+    """Запускает финальную сборку; потоковые переупаковки работают одновременно с ней."""
+    for producer in producers:
+        if not producer['streamed']:
+            await run_async_command(websocket, producer['command'], producer['title'], producer['tag'], producer['duration'])
+    tasks = [asyncio.create_task(run_async_command(websocket, p['command'], p['title'], p['tag'], p['duration'])) for p in producers if p['streamed']]
+    try:
+        await run_async_command(websocket, command, title, duration=duration)
+        await asyncio.gather(*tasks)
+    finally:
+        # Если сборка упала, писатели FIFO остались бы висеть в ожидании читателя.
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def build_final_command(concat_path, segments, intro_path, final_args, output_path):
+    """Команда финальной сборки: видео через concat-демультиплексор, звук — склейкой кусков."""
+    ffmpeg_audio_inputs, filter_complex, audio_label = audio.build_final_inputs(segments, intro_path)
+    command = ['ffmpeg','-hide_banner','-loglevel','error','-stats','-f','concat','-safe','0','-i', concat_path] + ffmpeg_audio_inputs + ['-filter_complex', filter_complex, '-map','0:v','-map', audio_label] + final_args + [output_path,'-y']
+    return command, filter_complex
+
+
+def format_stages(stages):
+    info = stages['transitions']
+    lines = ["Итог по этапам:",
+             "  Переходы и края звука: пропущены" if info == 'skipped' else
+             f"  Переходы и края звука: перерендерено {info['total'] - info['reused']}, переиспользовано {info['reused']} из {info['total']}"]
+    lines.append(f"  Финальная сборка: {'пропущена' if stages.get('final') == 'skipped' else 'выполнена'}")
+    return "\n".join(lines)
+
+
+async def report_metrics(websocket, report, params):
+    """Отправляет отчёт по этапам в интерфейс и сохраняет его в JSONL и Chrome trace."""
+    await send_log(websocket, metrics.format_report(report))
+    await websocket.send(json.dumps({"action": "metrics", "report": report}))
+    trace_dir = params.get('trace_dir') or TRACE_DIR
+    try:
+        if METRICS_FILE: await asyncio.to_thread(metrics.append_jsonl, METRICS_FILE, report)
+        if trace_dir: await send_log(websocket, f"Chrome trace: {await asyncio.to_thread(metrics.write_chrome_trace, trace_dir, report)}")
+    except OSError as e:
+        await send_log(websocket, f"Не удалось сохранить замеры: {e}")
+
+
+async def handle_processing(websocket, params, job_id=None):
+    temp_files_to_clean = []
+    store = None
+    pins = None
+    job_metrics = metrics.JobMetrics(job_id)
+    metrics_token = metrics.current.set(job_metrics)
+    status = 'failed'
+    try:
+        job_metrics.mark('prepare')
+        # У каждого задания свои временные папки; файл попадает в RAM, только если там хватит места.
+        store = tempstore.TempStore(job_id, params.get('use_ram'))
+        store.start_monitor()
+        await send_log(websocket, "--- Этап 1: Подготовка данных ---")
+        
+        intro_resolution = params.get('intro_resolution', '2k')
+        await send_log(websocket, f"Выбрано разрешение интро: {intro_resolution}")
+
+        # Таймлайн проверяется целиком до любого кодирования.
+        segments = timeline.segments_from_params(params)
+        errors = timeline.validate_segments(segments, FADE_DURATION)
+        if errors: raise ValueError("Ошибки в таймлайне:\n" + "\n".join(errors))
+        await send_log(websocket, f"Сегментов в таймлайне: {len(segments)}")
+
+        cache = open_render_cache(params)
+        # Всё, что задание берёт из кэша, закреплено до конца финальной сборки.
+        pins = cache.pins() if cache else None
+        intro_path = await prepare_intro(websocket, params, cache, pins)
+        
+        video_concat_parts = [f"file '{intro_path}'"]
+        final_audio_codec = params.get('audio_codec') or FINAL_AUDIO_CODEC
+        audio_codec_args = audio.codec_args(final_audio_codec)
+
+        job_metrics.mark('segments')
+        bit_rates = {}
+        for i, seg in enumerate(segments):
+            await send_log(websocket, f"\n--- Обработка сегмента {i+1} ---")
+            
+            seg['video'] = seg['video_orig']
+            seg['remux'] = source_remux_mode(seg['video'], params.get('source_remux') or SOURCE_REMUX)
+            if seg['remux'] == 'full':
+                base, _ = os.path.splitext(seg['video']); sanitized = f"{base}_sanitized.mkv"
+                if not os.path.exists(sanitized):
+                    await run_async_command(websocket, ['ffmpeg','-hide_banner','-loglevel', 'error','-stats','-i', seg['video'], '-c', 'copy', sanitized, '-y'], f"Переупаковка '{os.path.basename(seg['video'])}'", duration=await keyframes.probe_duration(seg['video']))
+                seg['video'] = sanitized
+            
+            seg['audio'] = seg['audio_orig']
+            if seg['audio_orig'] == seg['video_orig'] and seg['video'] != seg['video_orig']: seg['audio'] = seg['video']
+                 
+            with await keyframes.open_index(seg['video'], log=lambda m: send_log(websocket, m)) as index:
+                seg['start_split'] = index.first_after(seg['start'] + FADE_DURATION)
+                seg['end_split'] = index.last_before(seg['end'] - FADE_DURATION)
+            error = timeline.validate_split_points(seg, i)
+            if error: raise ValueError(error)
+            await send_log(websocket, f"Точки разделения: {seg['start_split']} -> {seg['end_split']}")
+            if seg['video'] not in bit_rates: bit_rates[seg['video']] = await keyframes.probe_bit_rate(seg['video'])
+            seg['video_bitrate'] = bit_rates[seg['video']]
+            audio.plan_segment_samples(seg, await audio.probe_sample_rate(seg['audio']))
+
+        job_metrics.mark('transitions')
+        await send_log(websocket, "\n--- Этап 2: Рендер переходов ---")
+        transition_plan = transitions.plan_transitions(segments, store.place, FADE_DURATION, VIDEO_ENCODER) + audio.plan_edges(segments, store.place, FADE_DURATION)
+        temp_files_to_clean.extend(t['output'] for t in transition_plan)
+
+        output_dir = os.path.dirname(segments[0]['video_orig'])
+        base_name, _ = os.path.splitext(os.path.basename(segments[0]['video_orig']))
+        res_prefix = params.get('intro_resolution', '2k')
+        output_name = f"{res_prefix}_{base_name.replace('_sanitized','').replace('part1','')}_final_edit.mkv"
+        output_path = os.path.join(output_dir, output_name)
+
+        # Сравниваем план с манифестом прошлой сборки этого же результата — до рендера:
+        # если не изменилось ничего и результат на месте, не рендерится ни один клип.
+        final_args = ['-c:v','copy','-r','60'] + audio_codec_args
+        clip_keys = [[t['cache_key'] for t in transition_plan if t['segment'] is seg] for seg in segments]
+        plan = manifest.build_plan(segments, clip_keys, intro_path, final_args)
+        manifest_path = manifest.manifest_path_for(output_path)
+        previous = manifest.load(manifest_path)
+        plan_diff = manifest.diff(previous, plan)
+        if not plan_diff['first_run']:
+            changed = ', '.join(str(i + 1) for i in plan_diff['changed_segments']) or 'нет'
+            await send_log(websocket, f"Сравнение с прошлой сборкой: изменённые сегменты — {changed}"
+                                      + (f", удалено сегментов: {plan_diff['removed_segments']}" if plan_diff['removed_segments'] else "")
+                                      + (", изменилось интро" if plan_diff['intro_changed'] else "")
+                                      + (", изменились параметры сборки" if plan_diff['final_args_changed'] else ""))
+        if plan_diff.get('identical') and manifest.output_unchanged(previous, output_path):
+            stages = {'transitions': 'skipped', 'final': 'skipped'}
+            await send_log(websocket, "План не изменился, результат на месте: рендер переходов и финальная сборка пропущены.")
+            await send_log(websocket, format_stages(stages))
+            await send_log(websocket, f"\nУСПЕХ! Финальный файл актуален: {output_path}")
+            status = 'done'
+            return output_path
+
+        workers = params.get('transition_workers') or TRANSITION_WORKERS
+        await send_log(websocket, f"Переходов: {len(transition_plan)}, одновременно: {workers}")
+        run = lambda cmd, title, tag, duration: run_async_command(websocket, cmd, title, tag, duration)
+        cache_hits = await transitions.render_transitions(transition_plan, run, workers, cache, pins, log=lambda m: send_log(websocket, m))
+        store.settle()
+        stages = {'transitions': {'total': len(transition_plan), 'reused': cache_hits}}
+        if cache: await send_log(websocket, f"Из кэша рендеров: {cache_hits} из {len(transition_plan)}")
+
+        job_metrics.mark('final')
+        body_producers = []
+        for i, seg in enumerate(segments):
+            if seg['remux'] == 'range':
+                # Переупаковываем только [start_split, end_split] — и потоком, без полной копии на диске.
+                body_path, producer = plan_range_remux(seg, i, store.place)
+                temp_files_to_clean.append(body_path)
+                body_producers.append(producer)
+                main_body = f"file '{body_path}'"
+            else:
+                main_body = f"file '{seg['video']}'\ninpoint {seg['start_split']}\noutpoint {seg['end_split']}"
+            video_concat_parts.extend([f"file '{seg['fade_in_path']}'", main_body, f"file '{seg['fade_out_path']}'"])
+
+        await send_log(websocket, "\n--- Этап 3: Финальная сборка ---")
+        concat_path = store.place("concat.txt", tempstore.estimate_bytes('text', 0)); temp_files_to_clean.append(concat_path)
+        with open(concat_path, 'w', encoding='utf-8') as f: f.write("\n".join(video_concat_parts))
+
+        final_cmd, filter_complex = build_final_command(concat_path, segments, intro_path, final_args, output_path)
+
+        total_duration = await keyframes.probe_duration(intro_path) + sum(seg['end'] - seg['start'] for seg in segments)
+        await run_with_producers(websocket, body_producers, final_cmd, "Запускаем финальную сборку", total_duration)
+        stages['final'] = 'done'
+        if cache:
+            # Без кэша пути клипов временные, и план не с чем сравнивать при следующем запуске.
+            manifest.save(manifest_path, plan, output_path, "\n".join(video_concat_parts), filter_complex, stages)
+        await send_log(websocket, format_stages(stages))
+        await send_log(websocket, f"\nУСПЕХ! Финальный файл сохранен: {output_path}")
+        status = 'done'
+        return output_path
+
+    except asyncio.CancelledError:
+        status = 'cancelled'
+        raise
+    except Exception as e:
+        import traceback
+        await send_log(websocket, f"\n\nКРИТИЧЕСКАЯ ОШИБКА: {str(e)}\n{traceback.format_exc()}\n")
+        if job_id: raise
+    finally:
+        job_metrics.mark('cleanup')
+        await send_log(websocket, "\n--- Очистка ---")
+        for f in temp_files_to_clean:
+            if os.path.exists(f): 
+                try:
+                    os.remove(f)
+                    await send_log(websocket, f"Удалено: {f}")
+                except OSError as e:
+                    await send_log(websocket, f"Не удалось удалить {f}: {e}")
+        if pins: pins.release()
+        if store:
+            await store.close()
+            await send_log(websocket, store.summary())
+            job_metrics.temp = store.report()
+        await report_metrics(websocket, job_metrics.report(status), params)
+        metrics.current.reset(metrics_token)
+        await websocket.send(json.dumps({"action": "finished"}))
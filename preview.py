@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import http
+import json
+import math
+import os
+import subprocess
+
+import keyframes
+import render_cache
+
+# ==============================================================================
+# ---                 ПРОКСИ ДЛЯ ПРЕДПРОСМОТРА И ЛЕНТА КАДРОВ                  ---
+# ==============================================================================
+# Оригиналы — тяжёлые MKV с редкими I-кадрами, а file:// из http-страницы браузер
+# не открывает. Поэтому для каждого исходника в фоне готовятся:
+#   <видео>.preview.mp4  — прокси низкого разрешения с частыми I-кадрами (быстрая перемотка);
+#   <видео>.thumbs.jpg   — лента миниатюр одним спрайтом, кадры берутся в моменты
+#                          I-кадров из <видео>.keyframes.idx (декодируются только они);
+#   <видео>.preview.json — описание: отпечаток исходника, моменты миниатюр, сетка спрайта.
+# Файлы лежат рядом с индексом I-кадров и пересоздаются, если исходник изменился.
+# Сервер отдаёт их по HTTP с поддержкой Range только для зарегистрированных исходников.
+PROXY_HEIGHT = 360
+PROXY_FPS = 30
+PROXY_GOP = 15          # I-кадр каждые полсекунды
+PROXY_CRF = 30
+THUMB_COUNT = 60
+THUMB_WIDTH = 160
+THUMB_COLUMNS = 10
+PREVIEW_WORKERS = 1     # прокси строятся по одному, чтобы не отнимать ядра у заданий
+RANGE_CHUNK = 4 * 1024**2  # максимум байт в одном ответе на открытый диапазон
+PREVIEW_VERSION = 1
+
+CONTENT_TYPES = {'proxy.mp4': 'video/mp4', 'thumbs.jpg': 'image/jpeg'}
+
+
+def paths_for(source):
+    return {'proxy.mp4': f"{source}.preview.mp4", 'thumbs.jpg': f"{source}.thumbs.jpg", 'meta': f"{source}.preview.json"}
+
+
+def token_for(source):
+    # Токен зависит от содержимого исходника, поэтому ответы можно кэшировать в браузере.
+    return hashlib.sha1(render_cache.source_identity(source).encode('utf-8')).hexdigest()[:16]
+
+
+def load_meta(source):
+    """Описание готового прокси или None, если его нет или исходник изменился."""
+    paths = paths_for(source)
+    try:
+        with open(paths['meta'], encoding='utf-8') as f:
+            meta = json.load(f)
+        st = os.stat(source)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != PREVIEW_VERSION or (meta.get('size'), meta.get('mtime_ns')) != (st.st_size, st.st_mtime_ns): return None
+    required = ['proxy.mp4'] + (['thumbs.jpg'] if meta.get('times') else [])
+    if not all(os.path.exists(paths[name]) for name in required): return None
+    return meta
+
+
+def pick_thumbnail_times(times, count=THUMB_COUNT):
+    """Равномерно выбирает не больше `count` моментов из списка I-кадров."""
+    if len(times) <= count: return list(times)
+    return sorted({times[round(i * (len(times) - 1) / (count - 1))] for i in range(count)})
+
+
+def proxy_command(source, output):
+    return ['ffmpeg','-hide_banner','-loglevel','error','-stats','-i', source, '-map','0:v:0','-map','0:a:0?',
+            '-vf', f"scale=-2:{PROXY_HEIGHT},fps={PROXY_FPS}", '-c:v','libx264','-preset','veryfast','-crf', str(PROXY_CRF),
+            '-g', str(PROXY_GOP), '-keyint_min', str(PROXY_GOP), '-sc_threshold','0', '-pix_fmt','yuv420p',
+            '-c:a','aac','-b:a','96k','-ac','2', '-movflags','+faststart', '-f','mp4', output, '-y']
+
+
+def thumbs_command(source, times, output):
+    # Декодируются только I-кадры (-skip_frame nokey), из них select оставляет выбранные моменты.
+    rows = max(1, math.ceil(len(times) / THUMB_COLUMNS))
+    select = '+'.join(f"lt(abs(t-{t:.6f}),0.001)" for t in times)
+    return ['ffmpeg','-hide_banner','-loglevel','error','-stats','-skip_frame','nokey','-i', source, '-an',
+            '-vf', f"select='{select}',scale={THUMB_WIDTH}:-2,tile={THUMB_COLUMNS}x{rows}",
+            '-frames:v','1','-q:v','5','-f','image2', output, '-y']
+
+
+async def build(source, run):
+    """Строит прокси и ленту миниатюр; `run(command, title, tag, duration)` запускает ffmpeg."""
+    paths = paths_for(source)
+    st = os.stat(source)
+    with await keyframes.open_index(source) as index:
+        times, duration = pick_thumbnail_times(list(index)), index.duration
+    name = os.path.basename(source)
+    tmp = {key: f"{path}.tmp{os.getpid()}{os.path.splitext(path)[1]}" for key, path in paths.items()}
+    try:
+        if times:
+            # Без ленты предпросмотр всё равно полезен: её ошибка не мешает собрать прокси.
+            try: await run(thumbs_command(source, times, tmp['thumbs.jpg']), f"Лента кадров '{name}'", f"preview {name}", duration)
+            except subprocess.CalledProcessError: pass
+            if not os.path.exists(tmp['thumbs.jpg']): times = []
+        await run(proxy_command(source, tmp['proxy.mp4']), f"Прокси для предпросмотра '{name}'", f"preview {name}", duration)
+        meta = {'version': PREVIEW_VERSION, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'duration': duration,
+                'times': times, 'columns': THUMB_COLUMNS, 'rows': max(1, math.ceil(len(times) / THUMB_COLUMNS))}
+        with open(tmp['meta'], 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        for key in ('thumbs.jpg', 'proxy.mp4', 'meta'):
+            if os.path.exists(tmp[key]): os.replace(tmp[key], paths[key])
+        return meta
+    finally:
+        for path in tmp.values():
+            if os.path.exists(path): os.remove(path)
+
+
+class PreviewManager:
+    """Фоновые сборки прокси и реестр исходников, чьи прокси можно отдавать по HTTP.
+
+    `run(command, title, tag, duration)` — корутина запуска ffmpeg,
+    `notify(status)` — корутина, рассылающая клиентам статус готовности.
+    """
+    def __init__(self, run, notify, workers=PREVIEW_WORKERS):
+        self._run = run
+        self._notify = notify
+        self._workers = workers
+        self._semaphore = None
+        self._tasks = {}
+        self._sources = {}  # токен -> исходник
+
+    def _status(self, source, state, meta=None, error=None):
+        status = {'path': source, 'state': state}
+        if meta:
+            token = token_for(source)
+            self._sources[token] = source
+            status.update({'proxy_url': f"/preview/{token}/proxy.mp4", 'thumbs_url': f"/preview/{token}/thumbs.jpg" if meta['times'] else None,
+                           'times': meta['times'], 'columns': meta['columns'], 'rows': meta['rows'], 'duration': meta['duration']})
+        if error: status['error'] = error
+        return status
+
+    def request(self, source):
+        """Возвращает текущий статус прокси; при необходимости ставит сборку в фон."""
+        if not source or not os.path.isfile(source): return self._status(source, 'failed', error="Файл не найден")
+        meta = load_meta(source)
+        if meta: return self._status(source, 'ready', meta)
+        if source not in self._tasks: self._tasks[source] = asyncio.create_task(self._build(source))
+        return self._status(source, 'building')
+
+    async def _build(self, source):
+        if self._semaphore is None: self._semaphore = asyncio.Semaphore(self._workers)
+        try:
+            async with self._semaphore:
+                meta = await build(source, self._run)
+            status = self._status(source, 'ready', meta)
+        except Exception as e:
+            status = self._status(source, 'failed', error=str(e))
+        finally:
+            self._tasks.pop(source, None)
+        await self._notify(status)
+
+    def file_for(self, token, name):
+        source = self._sources.get(token)
+        if source is None or name not in CONTENT_TYPES: return None
+        return paths_for(source)[name]
+
+    def respond(self, path, range_header):
+        """Ответ на GET /preview/<токен>/<файл> для process_request: (статус, заголовки, тело)."""
+        parts = path.split('?', 1)[0].strip('/').split('/')
+        file_path = self.file_for(parts[1], parts[2]) if len(parts) == 3 else None
+        if not file_path or not os.path.exists(file_path):
+            return http.HTTPStatus.NOT_FOUND, {}, b"Not found"
+        return serve_range(file_path, range_header, CONTENT_TYPES[parts[2]])
+
+
+def parse_range(range_header, size):
+    """(начало, конец) первого диапазона "bytes=a-b" включительно; None — весь файл; ValueError — неисполнимо."""
+    if not range_header or not range_header.startswith('bytes='): return None
+    first, _, last = range_header[6:].split(',')[0].strip().partition('-')
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+    else:
+        start, end = max(0, size - int(last)), size - 1
+    if start >= size or start > end: raise ValueError(range_header)
+    return start, min(end, size - 1)
+
+
+def serve_range(path, range_header, content_type, chunk=RANGE_CHUNK):
+    size = os.path.getsize(path)
+    headers = {'Content-Type': content_type, 'Accept-Ranges': 'bytes', 'Cache-Control': 'max-age=86400'}
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, {'Content-Range': f"bytes */{size}"}, b""
+    start, end = byte_range or (0, size - 1)
+    # Больше chunk байт за раз не читаем ни для какого запроса: тело ответа целиком
+    # держится в памяти. Файл крупнее отдаётся частями (206), браузер запросит продолжение.
+    end = min(end, start + chunk - 1)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        body = f.read(end - start + 1)
+    if byte_range is None and len(body) == size: return http.HTTPStatus.OK, headers, body
+    headers['Content-Range'] = f"bytes {start}-{start + len(body) - 1}/{size}"
+    return http.HTTPStatus.PARTIAL_CONTENT, headers, body
@@ -0,0 +1,97 @@
+import os
+import time
+
+# ==============================================================================
+# ---                   СТРУКТУРИРОВАННЫЙ ПРОГРЕСС FFMPEG                      ---
+# ==============================================================================
+# ffmpeg пишет машиночитаемый прогресс (-progress pipe:1) блоками "ключ=значение",
+# каждый блок завершается строкой progress=continue|end. Мы разбираем их в
+# типизированные события и отправляем клиенту не чаще PROGRESS_INTERVAL.
+# Человекочитаемые строки (stderr) копятся и уходят пачками.
+PROGRESS_INTERVAL = 0.5    # секунды между событиями прогресса
+LOG_FLUSH_INTERVAL = 0.25  # секунды между пачками строк журнала
+LOG_BATCH_MAX = 200        # максимум строк в одной пачке
+
+
+def with_progress_output(command):
+    """Добавляет к команде ffmpeg вывод прогресса в stdout вместо -stats в stderr."""
+    if not command or os.path.basename(str(command[0])) != 'ffmpeg': return list(command)
+    return [command[0], '-progress', 'pipe:1', '-nostats'] + [c for c in command[1:] if c != '-stats']
+
+
+def parse_time(value):
+    try:
+        h, m, s = str(value).split(':')
+        return int(h) * 3600 + int(m) * 60 + float(s)
+    except ValueError:
+        return None
+
+
+def _parse_float(value, suffix=''):
+    try: return float(str(value).strip().rstrip(suffix))
+    except ValueError: return None
+
+
+class ProgressTracker:
+    def __init__(self, duration, emit, interval=PROGRESS_INTERVAL, clock=time.monotonic):
+        self.duration = duration if duration and duration > 0 else None
+        self._emit = emit
+        self._interval = interval
+        self._clock = clock
+        self._fields = {}
+        self._last_emit = None
+        self.last_event = None
+
+    def _build_event(self, done):
+        f = self._fields
+        out_time = None
+        if f.get('out_time_us', 'N/A') != 'N/A': out_time = _parse_float(f['out_time_us'])
+        if out_time is not None: out_time /= 1_000_000
+        elif 'out_time' in f: out_time = parse_time(f['out_time'])
+        speed = _parse_float(f.get('speed', ''), 'x')
+        percent = eta = None
+        if self.duration and out_time is not None:
+            percent = 100.0 if done else max(0.0, min(100.0, out_time / self.duration * 100))
+            eta = 0.0 if done else (max(0.0, self.duration - out_time) / speed if speed else None)
+        return {
+            'out_time': out_time, 'fps': _parse_float(f.get('fps', '')), 'speed': speed,
+            'frame': int(f['frame']) if f.get('frame', '').isdigit() else None, 'percent': percent, 'eta': eta, 'done': done,
+        }
+
+    async def feed(self, line):
+        key, sep, value = line.strip().partition('=')
+        if not sep: return
+        if key != 'progress':
+            self._fields[key] = value.strip()
+            return
+        done = value.strip() == 'end'
+        now = self._clock()
+        if not done and self._last_emit is not None and now - self._last_emit < self._interval: return
+        self._last_emit = now
+        self.last_event = self._build_event(done)
+        await self._emit(self.last_event)
+
+
+class LogBatcher:
+    def __init__(self, flush, interval=LOG_FLUSH_INTERVAL, max_lines=LOG_BATCH_MAX, clock=time.monotonic):
+        self._flush = flush
+        self._interval = interval
+        self._max_lines = max_lines
+        self._clock = clock
+        self._lines = []
+        self._last_flush = clock()
+
+    async def add(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= self._max_lines: await self.flush()
+        else: await self.tick()
+
+    async def tick(self):
+        """Отправляет накопленное, только если с прошлой пачки прошло interval секунд."""
+        if self._clock() - self._last_flush >= self._interval: await self.flush()
+
+    async def flush(self):
+        self._last_flush = self._clock()
+        if not self._lines: return
+        lines, self._lines = self._lines, []
+        await self._flush(lines)
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import tempstore
+
+# ==============================================================================
+# ---                 КЭШ ОТРЕНДЕРЕННЫХ КЛИПОВ (ИНТРО, ПЕРЕХОДЫ)               ---
+# ==============================================================================
+# Ключ клипа — хэш от "отпечатков" исходников (путь, размер, mtime) и полной
+# команды ffmpeg без пути вывода: диапазона времени, графа фильтров, энкодера и
+# пресета. Любое изменение входных данных даёт новый ключ, а совпадающие клипы
+# берутся из кэша без перекодирования. Размер кэша ограничен, лишнее
+# вытесняется по давности использования (LRU по mtime файлов).
+# Записи, которые задание ещё будет читать (интро, переходы, края звука), оно
+# "закрепляет" файлом в .pins/ с pid процесса до конца финальной сборки: их не
+# вытесняют ни другие этапы, ни параллельные задания и процессы с тем же кэшем.
+RENDER_CACHE_DIR = os.environ.get("VIDEO_EDITOR_CACHE_DIR", os.path.expanduser("~/.cache/ffmpeg_video_editor/renders"))
+RENDER_CACHE_MAX_BYTES = 20 * 1024**3
+CACHE_FORMAT_VERSION = 1
+PIN_DIR = ".pins"
+
+
+def source_identity(path):
+    st = os.stat(path)
+    return f"{os.path.realpath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def command_key(command, inputs, output):
+    """Ключ для команды ffmpeg: входные файлы заменяются их отпечатками, путь вывода отбрасывается."""
+    inputs = set(inputs)
+    parts = [source_identity(arg) if arg in inputs else str(arg) for arg in command if arg != output]
+    payload = json.dumps([CACHE_FORMAT_VERSION] + parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CachePins:
+    """Закреплённые записи кэша одного задания; снимаются release()."""
+    def __init__(self, cache):
+        self.path = os.path.join(cache.root, PIN_DIR, f"{os.getpid()}_{uuid.uuid4().hex[:8]}.json")
+        self.paths = set()
+
+    def add(self, path):
+        if path in self.paths: return
+        self.paths.add(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'paths': sorted(self.paths)}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def release(self):
+        self.paths.clear()
+        try: os.remove(self.path)
+        except FileNotFoundError: pass
+
+
+class RenderCache:
+    def __init__(self, root=RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path_for(self, key, ext='.mkv'):
+        return os.path.join(self.root, key[:2], f"{key}{ext}")
+
+    def pins(self):
+        return CachePins(self)
+
+    def lookup(self, key, ext='.mkv', pins=None):
+        path = self.path_for(key, ext)
+        # Закрепляем до проверки: иначе запись могут вытеснить между проверкой и чтением.
+        if pins: pins.add(path)
+        try:
+            os.utime(path)  # отмечаем использование для LRU
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, key, rendered_path, pins=None):
+        """Переносит готовый клип в кэш и возвращает путь к записи кэша."""
+        path = self.path_for(key, os.path.splitext(rendered_path)[1])
+        if pins: pins.add(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        shutil.move(rendered_path, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict(protect={path})
+        return path
+
+    def _entries(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root and PIN_DIR in dirnames: dirnames.remove(PIN_DIR)
+            for name in filenames:
+                if '.tmp' in name: continue
+                path = os.path.join(dirpath, name)
+                try: st = os.stat(path)
+                except FileNotFoundError: continue
+                yield st.st_mtime, st.st_size, path
+
+    def usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def pinned(self):
+        """Пути, закреплённые живыми процессами; закрепления завершившихся процессов удаляются."""
+        paths = set()
+        pin_dir = os.path.join(self.root, PIN_DIR)
+        try: names = os.listdir(pin_dir)
+        except FileNotFoundError: return paths
+        for name in names:
+            if not name.endswith('.json'): continue
+            pin_path = os.path.join(pin_dir, name)
+            try:
+                with open(pin_path, encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if tempstore.pid_alive(data.get('pid', 0)): paths.update(data.get('paths', []))
+            else:
+                try: os.remove(pin_path)
+                except FileNotFoundError: pass
+        return paths
+
+    def evict(self, protect=()):
+        entries = sorted(self._entries())
+        protect = set(protect) | self.pinned()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes: break
+            if path in protect: continue
+            try: os.remove(path)
+            except FileNotFoundError: pass
+            total -= size
+            evicted += 1
+        return evicted
@@ -0,0 +1,192 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+# ==============================================================================
+# ---                  ВРЕМЕННЫЕ ФАЙЛЫ: RAM-ДИСК С ЗАПАСОМ                     ---
+# ==============================================================================
+# У каждого задания свои папки "ffmpeg_editor_job_<id>" на RAM-диске и на диске.
+# Перед планированием файла оценивается его размер (битрейт × длительность), и
+# файл кладётся в RAM, только если там хватает места с учётом запаса
+# RAM_RESERVE_BYTES, бюджета RAM_BUDGET_BYTES и уже обещанных другим файлам
+# (в том числе параллельных заданий) байт. Иначе — на диск, без ENOSPC посреди рендера.
+# В папке задания лежит .owner.json с pid процесса: папки упавших процессов
+# удаляются при следующем запуске (sweep_stale), а при обычном выходе — atexit.
+RAM_DIR = "/dev/shm"
+DISK_DIR = os.environ.get("VIDEO_EDITOR_TMP_DIR", ".")
+RAM_BUDGET_BYTES = None           # потолок RAM для всех заданий процесса (None — только свободное место)
+RAM_RESERVE_BYTES = 1 * 1024**3   # столько RAM-диска всегда остаётся свободным
+SAFETY_FACTOR = 1.25              # запас к оценке размера
+DEFAULT_VIDEO_BITRATE = 50_000_000  # бит/с, если ffprobe не сообщил битрейт исходника
+TRANSITION_BITRATE_FACTOR = 3.0   # переходы в ultrafast крупнее исходника того же разрешения
+AUDIO_CHANNELS_ESTIMATE = 2
+TEXT_FILE_ESTIMATE = 64 * 1024
+MONITOR_INTERVAL = 0.5            # период замера занятого места, с
+STALE_AGE = 24 * 3600             # папки без .owner.json старше этого считаются брошенными
+DIR_PREFIX = "ffmpeg_editor_job_"
+OWNER_FILE = ".owner.json"
+
+_live = set()  # открытые хранилища текущего процесса
+
+
+def estimate_bytes(kind, duration, seg=None):
+    """Оценка размера файла: 'video' — клип перехода, 'copy' — копия потока исходника,
+    'audio' — PCM/FLAC без сжатия, иначе — текст."""
+    seg = seg or {}
+    if kind == 'copy': rate = (seg.get('video_bitrate') or DEFAULT_VIDEO_BITRATE) / 8
+    elif kind == 'video': rate = (seg.get('video_bitrate') or DEFAULT_VIDEO_BITRATE) * TRANSITION_BITRATE_FACTOR / 8
+    elif kind == 'audio': rate = seg.get('sample_rate', 48000) * AUDIO_CHANNELS_ESTIMATE * 4
+    else: return TEXT_FILE_ESTIMATE
+    return int(max(0.0, duration) * rate * SAFETY_FACTOR)
+
+
+def safe_name(name):
+    """Имя для пути файла или папки: только латиница, цифры, "_", "-" и "."; иначе добавляется хэш."""
+    name = str(name)
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', name)[:64].strip('.') or '_'
+    if safe != name: safe += '_' + hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+    return safe
+
+
+def free_bytes(path):
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try: total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError: pass
+    return total
+
+
+def format_bytes(n):
+    for unit in ('Б', 'КБ', 'МБ'):
+        if n < 1024: return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} ГБ"
+
+
+def pid_alive(pid):
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: return True
+    return True
+
+
+def sweep_stale(roots=None):
+    """Удаляет папки заданий, чей процесс уже не существует (после сбоя или kill -9)."""
+    removed = []
+    live_dirs = {d for store in _live for d in store.dirs()}
+    for root in roots or (RAM_DIR, DISK_DIR):
+        try: names = os.listdir(root)
+        except OSError: continue
+        for name in names:
+            path = os.path.abspath(os.path.join(root, name))
+            if not name.startswith(DIR_PREFIX) or path in live_dirs or not os.path.isdir(path): continue
+            try:
+                with open(os.path.join(path, OWNER_FILE), encoding='utf-8') as f:
+                    stale = not pid_alive(json.load(f)['pid'])
+            except (OSError, ValueError, KeyError):
+                stale = time.time() - os.path.getmtime(path) > STALE_AGE
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+    return removed
+
+
+class TempStore:
+    def __init__(self, job_id=None, use_ram=False, ram_root=RAM_DIR, disk_root=DISK_DIR,
+                 budget=RAM_BUDGET_BYTES, reserve=RAM_RESERVE_BYTES):
+        self.job_id = job_id or uuid.uuid4().hex[:8]
+        # Id заданий пакетного режима берутся из манифеста и в путь попадают только после очистки.
+        name = f"{DIR_PREFIX}{safe_name(self.job_id)}"
+        self.ram_dir = os.path.join(ram_root, name) if use_ram and hasattr(os, 'statvfs') and os.path.isdir(ram_root) else None
+        self.disk_dir = os.path.abspath(os.path.join(disk_root, name))
+        self.budget = budget
+        self.reserve = reserve
+        self.peak = {'ram': 0, 'disk': 0}
+        self.placed = {'ram': 0, 'disk': 0}
+        self.spilled = []   # файлы, которым не хватило места в RAM
+        self._pending = {}  # путь в RAM -> обещанные, но ещё не записанные байты
+        self._monitor = None
+        for d in self.dirs():
+            os.makedirs(d, exist_ok=True)
+            with open(os.path.join(d, OWNER_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'pid': os.getpid(), 'job_id': self.job_id, 'created': time.time()}, f)
+        _live.add(self)
+
+    def dirs(self):
+        return [d for d in (self.ram_dir, self.disk_dir) if d]
+
+    def _ram_available(self):
+        pending = sum(sum(store._pending.values()) for store in _live)
+        available = free_bytes(self.ram_dir) - self.reserve - pending
+        if self.budget is not None:
+            used = sum(dir_size(store.ram_dir) for store in _live if store.ram_dir)
+            available = min(available, self.budget - used - pending)
+        return available
+
+    def place(self, name, estimated_bytes):
+        """Путь для нового временного файла: в RAM, если оценка помещается, иначе на диске."""
+        if self.ram_dir and estimated_bytes <= self._ram_available():
+            path = os.path.join(self.ram_dir, name)
+            self._pending[path] = estimated_bytes
+            self.placed['ram'] += 1
+            return path
+        if self.ram_dir: self.spilled.append(name)
+        self.placed['disk'] += 1
+        return os.path.join(self.disk_dir, name)
+
+    def settle(self):
+        """Вызывается после рендера: записанные файлы уже видны в свободном месте, обещания снимаются."""
+        self._sample()
+        self._pending.clear()
+
+    def _sample(self):
+        if self.ram_dir: self.peak['ram'] = max(self.peak['ram'], dir_size(self.ram_dir))
+        self.peak['disk'] = max(self.peak['disk'], dir_size(self.disk_dir))
+
+    async def _monitor_loop(self):
+        while True:
+            await asyncio.to_thread(self._sample)
+            await asyncio.sleep(MONITOR_INTERVAL)
+
+    def start_monitor(self):
+        self._monitor = asyncio.create_task(self._monitor_loop())
+
+    async def close(self):
+        if self._monitor:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+        await asyncio.to_thread(self._sample)
+        self.cleanup()
+
+    def cleanup(self):
+        for d in self.dirs(): shutil.rmtree(d, ignore_errors=True)
+        self._pending.clear()
+        _live.discard(self)
+
+    def report(self):
+        return {'peak_ram_bytes': self.peak['ram'], 'peak_disk_bytes': self.peak['disk'],
+                'ram_files': self.placed['ram'], 'disk_files': self.placed['disk'], 'spilled': list(self.spilled)}
+
+    def summary(self):
+        line = f"Временные файлы: пик в RAM {format_bytes(self.peak['ram'])}, на диске {format_bytes(self.peak['disk'])}"
+        if self.ram_dir:
+            line += f"; в RAM {self.placed['ram']}, на диске {self.placed['disk']}"
+            if self.spilled: line += f" (не хватило места в RAM: {', '.join(self.spilled)})"
+        return line
+
+
+@atexit.register
+def _cleanup_live():
+    for store in list(_live): store.cleanup()
@@ -0,0 +1,88 @@
+import math
+import os
+
+# ==============================================================================
+# ---                      МОДЕЛЬ ТАЙМЛАЙНА ИЗ N СЕГМЕНТОВ                     ---
+# ==============================================================================
+# Таймлайн — список сегментов {video, audio, start, end} из любого числа файлов.
+# Параметры старого формата (video1/video2, start1..end2, mode, is_single_segment)
+# приводятся к тому же списку. Ошибки в таймкодах ловятся до любого кодирования.
+MIN_BODY_DURATION = 0.5  # минимальная длина основной (копируемой) части сегмента, с
+
+
+def hms_to_seconds(time_str):
+    """ЧЧ:ММ:СС, ММ:СС или секунды; пустое значение — 0. Неразборчивый таймкод — ValueError."""
+    if time_str is None or not str(time_str).strip(): return 0
+    parts = str(time_str).strip().split(':')
+    if len(parts) > 3: raise ValueError(f"Неверный таймкод: {time_str}")
+    *whole, seconds = parts
+    if not all(part.strip().isdigit() for part in whole): raise ValueError(f"Неверный таймкод: {time_str}")
+    s = float(seconds)
+    if not math.isfinite(s) or s < 0: raise ValueError(f"Неверный таймкод: {time_str}")
+    for power, part in enumerate(reversed(whole), 1): s += int(part) * 60 ** power
+    return s
+
+
+def _legacy_segments(params):
+    if not params.get('video1'): raise ValueError("Не указан Видеофайл 1.")
+    segments = [{'video': params['video1'], 'audio': params.get('audio1'), 'start': params.get('start1'), 'end': params.get('end1')}]
+    is_single_segment = params.get('is_single_segment') and params.get('mode') == 'single'
+    if not is_single_segment:
+        video2_path = params['video1'] if params.get('mode') == 'single' else params.get('video2')
+        if not video2_path: raise ValueError("Не указан Видеофайл 2 для режима двух файлов.")
+        segments.append({'video': video2_path, 'audio': params.get('audio2'), 'start': params.get('start2'), 'end': params.get('end2')})
+    return segments
+
+
+def segments_from_params(params):
+    """Возвращает нормализованный список сегментов: video_orig, audio_orig, start, end (в секундах)."""
+    raw = params.get('segments') or _legacy_segments(params)
+    segments = []
+    for i, item in enumerate(raw):
+        video = item.get('video') or (segments[-1]['video_orig'] if segments else None)
+        if not video: raise ValueError(f"Сегмент {i+1}: не указан видеофайл.")
+        audio = item.get('audio')
+        if not audio:
+            # Как и раньше: сегмент из того же видео наследует заменённый звук предыдущего.
+            audio = segments[-1]['audio_orig'] if segments and segments[-1]['video_orig'] == video else video
+        seg = {'video_orig': video, 'audio_orig': audio}
+        for key in ('start', 'end'):
+            # Неразборчивый таймкод не превращается в 0: validate_segments сообщит о нём.
+            try: seg[key] = hms_to_seconds(item.get(key))
+            except ValueError: seg[key], seg[f"{key}_raw"] = None, item.get(key)
+        segments.append(seg)
+    if not segments: raise ValueError("Таймлайн пуст: добавьте хотя бы один сегмент.")
+    return segments
+
+
+def validate_segments(segments, fade_duration):
+    """Проверяет таймлайн целиком и возвращает список всех найденных ошибок."""
+    errors = []
+    min_length = 2 * fade_duration + MIN_BODY_DURATION
+    for i, seg in enumerate(segments):
+        for key in ('video_orig', 'audio_orig'):
+            if not os.path.exists(seg[key]): errors.append(f"Сегмент {i+1}: файл не найден: {seg[key]}")
+        bad = [(key, title) for key, title in (('start', 'начала'), ('end', 'конца')) if seg[key] is None]
+        for key, title in bad: errors.append(f"Сегмент {i+1}: не удалось разобрать таймкод {title}: «{seg[f'{key}_raw']}».")
+        if bad: continue
+        if seg['end'] <= seg['start']:
+            errors.append(f"Сегмент {i+1}: конец ({seg['end']:.2f} с) не позже начала ({seg['start']:.2f} с).")
+        elif seg['end'] - seg['start'] < min_length:
+            errors.append(f"Сегмент {i+1}: слишком короткий ({seg['end'] - seg['start']:.2f} с, нужно не меньше {min_length:.2f} с).")
+    by_source = {}
+    for i, seg in enumerate(segments):
+        if seg['start'] is None or seg['end'] is None: continue
+        by_source.setdefault(os.path.realpath(seg['video_orig']), []).append((seg['start'], seg['end'], i))
+    for ranges in by_source.values():
+        ranges.sort()
+        for (s1, e1, i1), (s2, e2, i2) in zip(ranges, ranges[1:]):
+            if s2 < e1: errors.append(f"Сегменты {i1+1} и {i2+1} перекрываются в одном исходнике ({s2:.2f} с < {e1:.2f} с).")
+    return errors
+
+
+def validate_split_points(seg, index):
+    if seg['start_split'] is None or seg['end_split'] is None:
+        return f"Не найдены точки разделения для сегмента {index+1}. Сегмент слишком короткий или неверные таймкоды."
+    if seg['end_split'] <= seg['start_split']:
+        return f"Сегмент {index+1}: между переходами нет ни одного ключевого кадра ({seg['start_split']} -> {seg['end_split']}). Сегмент слишком короткий."
+    return None
@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+import render_cache
+import tempstore
+
+# ==============================================================================
+# ---                   ПАРАЛЛЕЛЬНЫЙ РЕНДЕР ПЕРЕХОДОВ (FADE)                   ---
+# ==============================================================================
+# Все переходы независимы друг от друга: сначала планируем их целиком,
+# затем запускаем ограниченным пулом одновременных процессов ffmpeg.
+# Переходы, уже лежащие в кэше рендеров, не перекодируются.
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+
+def plan_transitions(segments, place, fade_duration, encoder, preset='ultrafast'):
+    """`place(name, estimated_bytes)` возвращает путь временного файла (см. tempstore.TempStore.place)."""
+    transitions = []
+    for i, seg in enumerate(segments):
+        seg['fout_rel'] = seg['end'] - seg['end_split'] - fade_duration
+        seg['fade_in_path'] = place(f"part{i+1}_fade_in.mkv", tempstore.estimate_bytes('video', seg['start_split'] - seg['start'], seg))
+        seg['fade_out_path'] = place(f"part{i+1}_fade_out.mkv", tempstore.estimate_bytes('video', seg['end'] - seg['end_split'], seg))
+        transitions.append({
+            'tag': f"part{i+1} fade-in", 'title': f"Создание fade-in (сегмент {i+1})", 'output': seg['fade_in_path'],
+            'duration': seg['start_split'] - seg['start'], 'segment': seg, 'path_key': 'fade_in_path', 'inputs': [seg['video']],
+            'command': ['ffmpeg','-hide_banner','-loglevel', 'error','-stats','-ss', str(seg['start']), '-to', str(seg['start_split']), '-i', seg['video'], '-an', '-vf', f"fade=in:st=0:d={fade_duration},setpts=PTS-STARTPTS", '-c:v', encoder, '-preset', preset, seg['fade_in_path'], '-y'],
+        })
+        transitions.append({
+            'tag': f"part{i+1} fade-out", 'title': f"Создание fade-out (сегмент {i+1})", 'output': seg['fade_out_path'],
+            'duration': seg['end'] - seg['end_split'], 'segment': seg, 'path_key': 'fade_out_path', 'inputs': [seg['video']],
+            'command': ['ffmpeg','-hide_banner','-loglevel', 'error','-stats','-ss', str(seg['end_split']), '-to', str(seg['end']), '-i', seg['video'], '-an', '-vf', f"fade=out:st={seg['fout_rel']:.4f}:d={fade_duration},setpts=PTS-STARTPTS", '-c:v', encoder, '-preset', preset, seg['fade_out_path'], '-y'],
+        })
+    return with_cache_keys(transitions)
+
+
+def with_cache_keys(transitions):
+    for t in transitions:
+        t['cache_key'] = render_cache.command_key(t['command'], t['inputs'], t['output'])
+    return transitions
+
+
+def _set_output(transition, path):
+    transition['output'] = path
+    transition['segment'][transition['path_key']] = path
+
+
+async def render_transitions(transitions, run, workers=DEFAULT_WORKERS, cache=None, pins=None, log=None):
+    """Рендерит переходы пулом из `workers` процессов; первая ошибка отменяет остальные.
+
+    `run(command, title, tag, duration)` — корутина, запускающая одну команду ffmpeg.
+    С `cache` готовые клипы берутся из кэша рендеров, а новые сохраняются в него;
+    пути в сегментах указывают на итоговые файлы. Итоговые пути закрепляются в `pins`
+    (render_cache.CachePins), чтобы их не вытеснили до финальной сборки.
+    Возвращает число попаданий в кэш.
+    """
+    semaphore = asyncio.Semaphore(max(1, int(workers)))
+    to_render = []
+    for t in transitions:
+        hit = cache.lookup(t['cache_key'], os.path.splitext(t['output'])[1], pins) if cache else None
+        if hit:
+            _set_output(t, hit)
+            if log: await log(f"[{t['tag']}] Взят из кэша рендеров")
+        else:
+            to_render.append(t)
+
+    async def render_one(transition):
+        async with semaphore:
+            await run(transition['command'], transition['title'], transition['tag'], transition['duration'])
+        if cache:
+            path = await asyncio.to_thread(cache.store, transition['cache_key'], transition['output'], pins)
+            _set_output(transition, path)
+
+    tasks = [asyncio.create_task(render_one(t)) for t in to_render]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return len(transitions) - len(to_render)